@@ -1,17 +1,67 @@
 from pynput import keyboard # needed for key input handling
-import os # needed for clearing the console
-import sys # needed for checking the operating system
+import argparse # needed for the command line options
+import queue # needed for passing the key presses to the input loop
+import time # needed for the frame interval
+import threading # needed for letting the AI think without blocking the keyboard
+from concurrent.futures import ThreadPoolExecutor, TimeoutError # needed for running the AI in the background
 # our own modules
 import classes # needed for the Board and Ship classes
 import solver # needed for the AI solver
+import transpositions # needed for remembering the positions the AI already solved
+import render # needed for redrawing only what changed on the screen
+import replays # needed for recording the games
 from colors import color as clr # needed for colored text
 
+# Everything is printed to this virtual screen, see render.Screen.frame
+screen = render.Screen()
+
+# The screen is redrawn at most once per frame interval (in seconds).
+# The keys pressed in between are handled together, see handle_keys.
+FRAME_INTERVAL = 1 / 30
+# The key presses waiting for the input loop, None stops it
+keyQueue = queue.Queue()
+# How each arrow key moves the cursor: (rows, columns)
+ARROWS = {
+    keyboard.Key.up: (-1, 0),
+    keyboard.Key.down: (1, 0),
+    keyboard.Key.left: (0, -1),
+    keyboard.Key.right: (0, 1),
+}
+# The game modes where the arrow keys move the cursor
+CURSOR_MODES = (1, 2, 3, 4)
+
+
+class CursorMove:
+    # A run of arrow key presses merged into one move of the cursor.
+    # The handlers of the cursor modes get this instead of the arrow keys.
+
+    def __init__(self: "CursorMove", rows: int, cols: int) -> None:
+        """
+        Args:
+            rows: How many rows the cursor moves down (negative for up).
+            cols: How many columns the cursor moves right (negative for left).
+        """
+        self.rows = rows
+        self.cols = cols
+
+    def apply(self: "CursorMove", cursor: list[int], board: "classes.Board") -> None:
+        """
+        Moves the cursor, wrapping around the edges like single arrow key presses.
+
+        Args:
+            cursor: The [row, column] of the cursor, changed in place.
+            board: The board the cursor is on.
+        """
+        cursor[0] = (cursor[0] + self.rows) % board.height
+        cursor[1] = (cursor[1] + self.cols) % board.width
+
+
 def clearConsole() -> None:
     """
     Clears the console screen.
 
-    This function checks the operating system and uses the appropriate command to clear the console screen.
-    On Windows, it uses the 'cls' command, while on Mac and Linux, it uses the 'clear' command.
+    Only the screen's frame is cleared: when the frame is shown, the terminal gets just the
+    characters that differ from what it shows, so nothing flickers and no 'clear' command runs.
 
     Parameters:
     None
@@ -19,11 +69,7 @@ def clearConsole() -> None:
     Returns:
     None
     """
-    isWindows = sys.platform.startswith("win")
-    if not isWindows:  # Mac, Linux needs 'clear' instead of 'cls' to clear the console
-        os.system("clear")
-    else:
-        os.system("cls")
+    screen.clear()
 
 
 # Global Variables
@@ -61,11 +107,29 @@ gm2TurnPart = 0
 gm4TurnPart = 0
 # cursor: [row, col]
 cursor = [0, 0]
-
-#known bug: MacOS (specifically Sonoma)
-# On MacOS, if this value is too large, the AI mode will break
-# This disctates how many ships the AI should search.
-buggy_depth=100 #this seems to be a good amount. Anything larger crashes
+# history: the squares fired at, in order (players fire in turn, player 1 first)
+history = []
+# The replay log the game is recorded in, None if it is not recorded (see main)
+replay_log = None
+# True once the game is in the replay log
+recorded = False
+
+# How long the AI may think per turn, in milliseconds.
+# It stops earlier once its best guess is statistically settled.
+ai_budget_ms = 1000
+# The AI's solver for player 1's board, created when the AI game starts
+ai_solver = None
+# The AI thinks on a background thread, so the keyboard listener never waits for it.
+# The solver keeps its samples between turns, so it runs in a thread rather than a process.
+ai_executor = ThreadPoolExecutor(max_workers=1)
+# The AI's next move (a Future of solve_within), computed while the human is still aiming
+ai_move = None
+# [share of the budget used, samples drawn] of the move being computed
+ai_progress = [0.0, 0]
+# True while the AI's turn waits for its move, keys are ignored then
+ai_waiting = False
+# Held while handling a key or drawing from the background thread, so they never interleave
+screen_lock = threading.RLock()
 
 
 def gameOver(ai=False) -> bool:
@@ -82,10 +146,11 @@ def gameOver(ai=False) -> bool:
     p1Board = players[0]
     p2Board = players[1]
     # check if player 1 lost
-    p1Lost = all([ship.isSunk(p1Board) for ship in p1Board.ships])
+    p1Lost = p1Board.gameOver()
     # check if player 2 lost
-    p2Lost = all([ship.isSunk(p2Board) for ship in p2Board.ships])
+    p2Lost = p2Board.gameOver()
     if p1Lost or p2Lost:
+        recordGame(1 if p1Lost else 0)
         clearConsole()
         print(
             f"\r{clr.BOLD+clr.OKGREEN}Game Over!, {'Player 2' if p1Lost else 'Player 1'} wins!{clr.ENDC}\n\n"
@@ -100,6 +165,22 @@ def gameOver(ai=False) -> bool:
     return p1Lost or p2Lost
 
 
+def recordGame(winner=None):
+    """
+    Appends the game to the replay log, if the game is recorded and both fleets are placed.
+    A game is only recorded once.
+
+    Args:
+        winner: The index of the player who won, None if the game was not finished.
+    """
+    global recorded
+    if replay_log is None or recorded or gameMode not in (2, 4):
+        return
+    replay_log.append(players, history, winner=winner)
+    replay_log.flush()
+    recorded = True
+
+
 def printInstr():
     """
     Prints the instruction string at the current index in the instructions list.
@@ -149,14 +230,7 @@ def setupAI():
     """
     global players
     players[1] = classes.Board()
-    shipsLeft = 5
-    while shipsLeft > 0:
-        nextShip = list(classes.Board.types.keys())[5 - shipsLeft]
-        nextShipLength = classes.Board.types[nextShip]
-        ship = classes.Ship([(0, 0) for i in range(nextShipLength)], nextShip)
-        players[1].placeShipRandom(nextShip)
-        shipsLeft -= 1
-    return True
+    return players[1].placeFleetRandom()
 
 
 def handle_gm0(key):
@@ -215,7 +289,7 @@ def handle_gm1_2p(key):
     global gm1TurnPart
     global cursor
     # Cycle forward
-    shipsLeft = 5 - len(players[turn].ships)
+    shipsLeft = len(players[turn].types) - len(players[turn].ships)
 
     if shipsLeft == 0:
         clearConsole()
@@ -232,35 +306,21 @@ def handle_gm1_2p(key):
         return True
     if gm1TurnPart == 1:
         clearConsole()
-        nextShip = list(classes.Board.types.keys())[shipsLeft - 1]
-        nextShipLength = classes.Board.types[nextShip]
+        nextShip = list(players[turn].types.keys())[shipsLeft - 1]
+        nextShipLength = players[turn].types[nextShip]
         # Movement
-        if (
-            key == keyboard.Key.up
-            or key == keyboard.Key.down
-            or key == keyboard.Key.left
-            or key == keyboard.Key.right
-        ):
-            if key == keyboard.Key.up:
-                cursor[0] = (cursor[0] - 1) % 10
-            elif key == keyboard.Key.down:
-                cursor[0] = (cursor[0] + 1) % 10
-            elif key == keyboard.Key.left:
-                cursor[1] = (cursor[1] - 1) % 10
-            elif key == keyboard.Key.right:
-                cursor[1] = (cursor[1] + 1) % 10
+        if isinstance(key, CursorMove):  # arrow keys, see handle_keys
+            key.apply(cursor, players[turn])
         # Orientation
         elif key == keyboard.KeyCode.from_char(
             "h"
         ) or key == keyboard.KeyCode.from_char("v"):
             # Place the ship
-            ship = classes.Ship([(0, 0) for i in range(nextShipLength)], nextShip)
             if key == keyboard.KeyCode.from_char("h"):
-                for i in range(nextShipLength):
-                    ship.squares[i] = (cursor[0], cursor[1] + i)
+                squares = [(cursor[0], cursor[1] + i) for i in range(nextShipLength)]
             else:
-                for i in range(nextShipLength):
-                    ship.squares[i] = (cursor[0] + i, cursor[1])
+                squares = [(cursor[0] + i, cursor[1]) for i in range(nextShipLength)]
+            ship = classes.Ship(squares, nextShip)
 
             # Check if the ship can be placed
             if players[turn].placeShip(ship):
@@ -303,45 +363,33 @@ def handle_gm3_AI(key):
     global turn
     # Cycle forward
     turn = 0
-    shipsLeft = 5 - len(players[turn].ships)
+    shipsLeft = len(players[turn].types) - len(players[turn].ships)
     gm3TurnPart = 1
     if shipsLeft == 0:
         clearConsole()
         print("\rAll ships placed!\nPress any key to start the game.")
         gameMode = 4
+        # the AI's first move does not depend on the human's moves, start on it right away
+        thinkAhead()
         return True
 
     if gm3TurnPart == 1:
         clearConsole()
-        nextShip = list(classes.Board.types.keys())[shipsLeft - 1]
-        nextShipLength = classes.Board.types[nextShip]
+        nextShip = list(players[turn].types.keys())[shipsLeft - 1]
+        nextShipLength = players[turn].types[nextShip]
         # Movement
-        if (
-            key == keyboard.Key.up
-            or key == keyboard.Key.down
-            or key == keyboard.Key.left
-            or key == keyboard.Key.right
-        ):
-            if key == keyboard.Key.up:
-                cursor[0] = (cursor[0] - 1) % 10
-            elif key == keyboard.Key.down:
-                cursor[0] = (cursor[0] + 1) % 10
-            elif key == keyboard.Key.left:
-                cursor[1] = (cursor[1] - 1) % 10
-            elif key == keyboard.Key.right:
-                cursor[1] = (cursor[1] + 1) % 10
+        if isinstance(key, CursorMove):  # arrow keys, see handle_keys
+            key.apply(cursor, players[turn])
         # Orientation
         elif key == keyboard.KeyCode.from_char(
             "h"
         ) or key == keyboard.KeyCode.from_char("v"):
             # Place the ship
-            ship = classes.Ship([(0, 0) for i in range(nextShipLength)], nextShip)
             if key == keyboard.KeyCode.from_char("h"):
-                for i in range(nextShipLength):
-                    ship.squares[i] = (cursor[0], cursor[1] + i)
+                squares = [(cursor[0], cursor[1] + i) for i in range(nextShipLength)]
             else:
-                for i in range(nextShipLength):
-                    ship.squares[i] = (cursor[0] + i, cursor[1])
+                squares = [(cursor[0] + i, cursor[1]) for i in range(nextShipLength)]
+            ship = classes.Ship(squares, nextShip)
 
             # Check if the ship can be placed
             if players[turn].placeShip(ship):
@@ -389,37 +437,21 @@ def handle_gm2_2p(key):
             print("\rBad input! Press any key to continue.")
             gm2TurnPart = 0
             return True
-        board = players[(turn + 1) % 2]
-        sunkShips = set([ship for ship in board.ships if ship.isSunk(board)])
         result = players[(turn + 1) % 2].hit(tuple(cursor))
-        if result == True:
-            sunkThisTurn = (
-                set([ship for ship in board.ships if ship.isSunk(board)]) - sunkShips
-            )
+        history.append(tuple(cursor))
+        if result:
             print(
-                f"\r{clr.FAIL}Hit! {'You sunk the '+clr.WARNING+sunkThisTurn.pop().shipType+'!' if sunkThisTurn else ''}{clr.ENDC}\n"
+                f"\r{clr.FAIL}Hit! {'You sunk the '+clr.WARNING+result.shipType+'!' if result.sunk else ''}{clr.ENDC}\n"
             )
-        elif result == False:
+        else:
             print(clr.OKGREEN + "\rMiss!" + clr.ENDC)
         # Update the game state
         turn = (turn + 1) % 2
         gm2TurnPart = 0
         return True
     # Movement
-    if (
-        key == keyboard.Key.up
-        or key == keyboard.Key.down
-        or key == keyboard.Key.left
-        or key == keyboard.Key.right
-    ):
-        if key == keyboard.Key.up:
-            cursor[0] = (cursor[0] - 1) % 10
-        elif key == keyboard.Key.down:
-            cursor[0] = (cursor[0] + 1) % 10
-        elif key == keyboard.Key.left:
-            cursor[1] = (cursor[1] - 1) % 10
-        elif key == keyboard.Key.right:
-            cursor[1] = (cursor[1] + 1) % 10
+    if isinstance(key, CursorMove):  # arrow keys, see handle_keys
+        key.apply(cursor, players[(turn + 1) % 2])
     print(f"\rPlayer {turn+1}: {clr.BOLD}{clr.WARNING}Firing...{clr.ENDC}\n")
     print("\rUse Arrow keys to move the cursor, Enter to fire\n")
 
@@ -456,72 +488,118 @@ def handle_gm4_AI(key):
                 print("\rBad input! Press any key to continue.")
                 gm4TurnPart = 0
                 return True
-            board = ai_board
-            sunkShips = set([ship for ship in board.ships if ship.isSunk(board)])
             result = ai_board.hit(tuple(cursor))
-            if result == True:
-                sunkThisTurn = (
-                    set([ship for ship in board.ships if ship.isSunk(board)])
-                    - sunkShips
-                )
+            history.append(tuple(cursor))
+            if result:
                 print(
-                    f"\r{clr.FAIL}Hit! {'You sunk the '+clr.WARNING+sunkThisTurn.pop().shipType+'!' if sunkThisTurn else ''}{clr.ENDC}\n"
+                    f"\r{clr.FAIL}Hit! {'You sunk the '+clr.WARNING+result.shipType+'!' if result.sunk else ''}{clr.ENDC}\n"
                 )
-            elif result == False:
+            else:
                 print("\rMiss!")
             turn = (turn + 1) % 2
             return True
-        if (
-            key == keyboard.Key.up
-            or key == keyboard.Key.down
-            or key == keyboard.Key.left
-            or key == keyboard.Key.right
-        ):
-            if key == keyboard.Key.up:
-                cursor[0] = (cursor[0] - 1) % 10
-            elif key == keyboard.Key.down:
-                cursor[0] = (cursor[0] + 1) % 10
-            elif key == keyboard.Key.left:
-                cursor[1] = (cursor[1] - 1) % 10
-            elif key == keyboard.Key.right:
-                cursor[1] = (cursor[1] + 1) % 10
+        if isinstance(key, CursorMove):  # arrow keys, see handle_keys
+            key.apply(cursor, ai_board)
         print("\rUse Arrow keys to move the cursor, Enter to fire\n")
         # Update the game state
     else:  # AI
-        print("\rAI's Turn! (This might take a few seconds...)\n")
-        global buggy_depth
-        square_freq = solver.solve_battleship(player_board,buggy_depth)
-        max_freq = 0
-        target = (0, 0)
-        for i in range(10):
-            for j in range(10):
-                if square_freq[i][j] > max_freq:
-                    max_freq = square_freq[i][j]
-                    target = (i, j)
-        result = player_board.hit(target)
-        row, col = target
-        rowLetter = chr(row + 65)
-        print(f"\rThe AI fired at {rowLetter}{col + 1}")
-        board = player_board
-        sunkShips = set([ship for ship in board.ships if ship.isSunk(board)])
-        if result == True:
-            sunkThisTurn = (
-                set([ship for ship in board.ships if ship.isSunk(board)]) - sunkShips
-            )
-            print(
-                f"\r{clr.FAIL}Hit! {'The AI sunk the '+clr.WARNING+sunkThisTurn.pop().shipType+'!' if sunkThisTurn else ''}{clr.ENDC}\n"
-            )
-        elif result == False:
-            print(clr.OKGREEN + "\rMiss!" + clr.ENDC)
-        print(player_board.stringify())
-        turn = (turn + 1) % 2
-        gm4TurnPart = 0
+        print("\rAI's Turn!\n")
+        global ai_waiting
+        if ai_move is None:
+            thinkAhead()
+        if not ai_move.done():
+            # don't block the keyboard, the AI fires as soon as its move is ready
+            ai_waiting = True
+            threading.Thread(target=waitForAI, daemon=True).start()
+            return True
+        aiFire(ai_move.result()[0])
         return True
 
     gm4TurnPart = 1
     print(players[(turn + 1) % 2].stringify(cursor, False))
 
 
+def thinkAhead():
+    """
+    Starts computing the AI's next move in the background.
+    The human only fires at the AI's board, so the move stays valid until the AI fires.
+    """
+    global ai_solver
+    global ai_move
+    player_board = players[0]
+    if ai_solver is None or ai_solver.board is not player_board:
+        # keep the sampled fleets between turns, each shot only rules out some of them,
+        # and answer the openings of later games from the cache
+        ai_solver = solver.Solver(player_board, "auto", reuse=True, cache=transpositions.shared_cache())
+    ai_progress[:] = [0.0, 0]
+
+    def progress(share, samples):
+        ai_progress[:] = [share, samples]
+
+    ai_move = ai_executor.submit(ai_solver.solve_within, ai_budget_ms, None, progress)
+
+
+def waitForAI():
+    """
+    Shows the AI's progress until its move is ready, then plays it (runs on its own thread).
+    """
+    global ai_waiting
+    while True:
+        try:
+            square_freq, _ = ai_move.result(timeout=0.1)
+            break
+        except TimeoutError:
+            share, samples = ai_progress
+            bar = "#" * int(share * 20)
+            with screen_lock, screen.frame():
+                print(f"\rThe AI is thinking [{bar:<20}] {samples} fleets", end="", flush=True)
+    with screen_lock, screen.frame():
+        ai_waiting = False
+        print("\r" + " " * 60)
+        aiFire(square_freq)
+
+
+def aiFire(square_freq):
+    """
+    Fires the AI's shot at the square with the highest frequency, shows the result
+    and starts on the AI's next move.
+
+    Args:
+        square_freq: The frequency map of the AI's move.
+    """
+    global turn
+    global gm4TurnPart
+    player_board = players[0]
+    max_freq = 0
+    target = (0, 0)
+    for i, row in enumerate(square_freq):
+        for j, freq in enumerate(row):
+            if freq > max_freq:
+                max_freq = freq
+                target = (i, j)
+    result = player_board.hit(target)
+    history.append(target)
+    ai_solver.observe(target, result)
+    row, col = target
+    rowLetter = classes.Board.rowLabel(row)
+    print(f"\rThe AI fired at {rowLetter}{col + 1}")
+    if result:
+        # the AI is told which ship it sunk, like a human player
+        if result.sunk:
+            ai_solver.sink(result.shipType)
+        print(
+            f"\r{clr.FAIL}Hit! {'The AI sunk the '+clr.WARNING+result.shipType+'!' if result.sunk else ''}{clr.ENDC}\n"
+        )
+    else:
+        print(clr.OKGREEN + "\rMiss!" + clr.ENDC)
+    print(player_board.stringify())
+    print("\rPress any key to continue.")
+    turn = (turn + 1) % 2
+    gm4TurnPart = 0
+    if not player_board.gameOver():
+        thinkAhead()
+
+
 def on_press(key: keyboard.Key):
     """
     Handles the key press event.
@@ -533,8 +611,74 @@ def on_press(key: keyboard.Key):
     - False: If the key is 'q' or the escape key (keyboard.Key.esc).
     """
     if (hasattr(key, "char") and key.char.lower() == "q") or key == keyboard.Key.esc:
+        keyQueue.put(None)
         return False
 
+    # Only queue the key, so the listener never waits for the game
+    keyQueue.put(key)
+
+
+def inputLoop():
+    """
+    Handles the queued key presses until the game stops.
+    Every key pressed since the last frame is handled at once and drawn as one frame,
+    so holding a key down never makes the screen fall behind.
+    """
+    while True:
+        keys = [keyQueue.get()]
+        while True:
+            try:
+                keys.append(keyQueue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in keys
+        if stop:
+            keys = keys[: keys.index(None)]
+        frameStart = time.perf_counter()
+        with screen_lock, screen.frame():
+            running = handle_keys(keys)
+        if stop or not running:
+            return
+        time.sleep(max(0.0, frameStart + FRAME_INTERVAL - time.perf_counter()))
+
+
+def handle_keys(keys: list) -> bool:
+    """
+    Handles a batch of key presses in order. In the cursor modes, each run of arrow keys
+    is merged into a single CursorMove, so it costs one handler call.
+
+    Args:
+        keys: The key presses.
+
+    Returns:
+        bool: False if the game should stop, True otherwise.
+    """
+    move = None
+    for key in keys:
+        if ai_waiting:  # the AI is firing, the keys are for the human's turn
+            continue
+        if key in ARROWS and gameMode in CURSOR_MODES:
+            rows, cols = ARROWS[key]
+            if move is not None:
+                rows += move.rows
+                cols += move.cols
+            move = CursorMove(rows, cols)
+            continue
+        if move is not None:
+            if handle_key(move) is False:
+                return False
+            move = None
+        if handle_key(key) is False:
+            return False
+    if move is not None and handle_key(move) is False:
+        return False
+    return True
+
+
+def handle_key(key):
+    """
+    Passes the key press to the handler of the current game mode.
+    """
     global gameMode
 
     try:
@@ -590,10 +734,22 @@ def welcome():
 
 
 def main():
-    welcome()
-    # Start the listener
-    with keyboard.Listener(on_press=on_press, suppress=True) as listener:
-        listener.join()
+    global replay_log
+    parser = argparse.ArgumentParser(description="Play Battleship in the terminal.")
+    parser.add_argument("--log", help="append the game to this replay log (see replays)")
+    args = parser.parse_args()
+    if args.log:
+        replay_log = replays.ReplayLog(args.log)
+
+    with screen.frame():
+        welcome()
+    # Start the listener, the keys are handled on this thread
+    with keyboard.Listener(on_press=on_press, suppress=True):
+        inputLoop()
+    # a game left before the end is recorded as unfinished
+    recordGame()
+    if replay_log is not None:
+        replay_log.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,258 @@
+# Description: This file contains the microbenchmarks of the Board operations and the solver phases.
+# It times every benchmark on a fixed corpus of seeded board states, writes the results as JSON
+# and compares them with a stored baseline, for example:
+#   python bench.py --save-baseline bench_baseline.json   (once, on a known good version)
+#   python bench.py --baseline bench_baseline.json        (fails if something got slower)
+import argparse # needed for the command line options
+import json # needed for the machine-readable results
+import platform # needed for recording where the benchmarks ran
+import random # needed for the seeded corpus
+import sys # needed for the exit code
+import timeit # needed for the timings
+from functools import partial
+# our own modules
+from classes import Board, BitBoard, Ship # needed for the board benchmarks
+from placements import PlacementTable, placement_table # needed for the solver phases
+import codec # needed for the serialization benchmarks
+import solver # needed for the solver phases
+
+# Number of shots fired in each board state of the corpus
+STAGES = {"opening": 0, "midgame": 30, "endgame": 60}
+# Seed of the corpus, changing it makes the results incomparable with older baselines
+CORPUS_SEED = 2024
+# A benchmark is a regression if it is this many times slower than the baseline
+DEFAULT_THRESHOLD = 1.25
+# A large variant of the game, to keep the placement table and fleet generator scaling
+LARGE_SIZE = 100
+LARGE_FLEET = {f"{name}{i}": length for i in range(1, 6) for name, length in Board.types.items()}
+# Benchmarks that need a fresh state are timed one call at a time, this many times
+SETUP_REPEAT = 200
+
+
+def corpus(engine: type = Board) -> dict[str, "Board"]:
+    """
+    Builds the seeded board states of the corpus: the same fleet with 0, 30 and 60 random shots.
+
+    Args:
+        engine: The board class to use (Board or BitBoard).
+
+    Returns:
+        dict: The board of each stage.
+    """
+    boards = {}
+    for stage, shots in STAGES.items():
+        random.seed(CORPUS_SEED) # Board.placeShipRandom uses the random module
+        board = engine()
+        board.placeFleetRandom()
+        squares = [(r, c) for r in range(10) for c in range(10)]
+        random.Random(CORPUS_SEED).shuffle(squares)
+        for square in squares[:shots]:
+            board.hit(square)
+        boards[stage] = board
+    return boards
+
+
+def measure(function, repeat: int = 5, setup=None) -> float:
+    """
+    Times a function.
+
+    Args:
+        function: The function to time, called without arguments.
+        repeat: The number of measurements, the fastest one is kept.
+        setup: If given, called (untimed) before every call of the function, which is then
+            timed SETUP_REPEAT times one call at a time.
+
+    Returns:
+        float: The time of one call in seconds.
+    """
+    if setup is not None:
+        return min(timeit.Timer(function, setup).repeat(repeat=SETUP_REPEAT, number=1))
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def boardBenchmarks(engine: type) -> dict:
+    """
+    Returns the benchmarks of the Board operations, as name: function
+    (or name: (setup, function) for the ones that change their board).
+    """
+    prefix = engine.__name__
+    fleet = corpus(engine)["opening"].ships
+    squares = [(r, c) for r in range(10) for c in range(10)]
+    # hit changes its board, so every call gets a fresh copy of the midgame
+    midgame = codec.encode_board(corpus(engine)["midgame"])
+    hitBoard = None
+
+    def freshBoard():
+        nonlocal hitBoard
+        hitBoard, _ = codec.decode_board(midgame, engine=engine)
+
+    def hitAll():
+        for square in squares:
+            hitBoard.hit(square)
+
+    def placeFleet():
+        board = engine()
+        for ship in fleet:
+            board.placeShip(Ship(list(ship.squares), ship.shipType))
+
+    def placeShipRandom():
+        random.seed(CORPUS_SEED)
+        board = engine()
+        for shipType in Board.types:
+            board.placeShipRandom(shipType)
+
+    def placeFleetRandom():
+        random.seed(CORPUS_SEED)
+        engine().placeFleetRandom()
+
+    benchmarks = {
+        f"{prefix}.hit[x100]": (freshBoard, hitAll),
+        f"{prefix}.placeShip[fleet]": placeFleet,
+        f"{prefix}.placeShipRandom[fleet]": placeShipRandom,
+        f"{prefix}.placeFleetRandom": placeFleetRandom,
+    }
+    for stage, board in corpus(engine).items():
+        benchmarks[f"{prefix}.gameOver[{stage}]"] = board.gameOver
+        benchmarks[f"{prefix}.stringify[{stage}]"] = board.stringify
+        benchmarks[f"{prefix}.encode[{stage}]"] = partial(codec.encode_board, board)
+        benchmarks[f"{prefix}.decode[{stage}]"] = partial(codec.decode_board, codec.encode_board(board), engine=engine)
+    return benchmarks
+
+
+def solverBenchmarks(cycles: int) -> dict:
+    """
+    Returns the benchmarks of the solver phases on every board state, as name: function.
+    """
+    fleet = tuple(Board.types.items())
+    table = placement_table(10, 10, fleet)
+    largeFleet = tuple(LARGE_FLEET.items())
+    largeTable = placement_table(LARGE_SIZE, LARGE_SIZE, largeFleet)
+    benchmarks = {
+        # enumeration builds the table from scratch, the solver uses the cached one
+        "solver.enumeration": lambda: PlacementTable(10, 10, fleet),
+        "solver.conflicts": table.build_conflicts,
+        "solver.randomFleets[x1000]": lambda: table.random_fleets(1000, random.Random(CORPUS_SEED)),
+        "solver.enumeration[large]": lambda: PlacementTable(LARGE_SIZE, LARGE_SIZE, largeFleet),
+        "solver.randomFleets[large]": lambda: largeTable.random_fleets(1, random.Random(CORPUS_SEED)),
+    }
+    for stage, board in corpus().items():
+        miss_mask, hit_mask = solver.board_masks(board)
+        possible_loc = table.live(miss_mask)
+        location_freq, valid_cnt, _, _ = solver.sample_sequential(
+            table, possible_loc, cycles, hit_mask, random.Random(CORPUS_SEED)
+        )
+        shot_mask = miss_mask | hit_mask
+
+        def live(miss_mask=miss_mask):
+            table.live(miss_mask)
+
+        def sampleRejection(possible_loc=possible_loc, hit_mask=hit_mask):
+            solver.sample_configurations(table, possible_loc, cycles, hit_mask, random.Random(CORPUS_SEED))
+
+        def sampleSequential(possible_loc=possible_loc, hit_mask=hit_mask):
+            solver.sample_sequential(table, possible_loc, cycles, hit_mask, random.Random(CORPUS_SEED))
+
+        def aggregate(location_freq=location_freq, valid_cnt=valid_cnt, shot_mask=shot_mask):
+            solver.square_frequencies(table, location_freq, valid_cnt, shot_mask)
+
+        benchmarks[f"solver.live[{stage}]"] = live
+        benchmarks[f"solver.sample[{stage}]"] = sampleRejection
+        benchmarks[f"solver.sequential[{stage}]"] = sampleSequential
+        benchmarks[f"solver.aggregation[{stage}]"] = aggregate
+    return benchmarks
+
+
+def runBenchmarks(cycles: int = 200, pattern: str = "") -> dict[str, float]:
+    """
+    Runs every benchmark whose name contains the pattern.
+
+    Args:
+        cycles: The number of samples drawn by the sampling benchmarks.
+        pattern: Only run the benchmarks whose name contains this.
+
+    Returns:
+        dict: The time of one call of each benchmark in seconds.
+    """
+    benchmarks = {}
+    for engine in (Board, BitBoard):
+        benchmarks.update(boardBenchmarks(engine))
+    benchmarks.update(solverBenchmarks(cycles))
+
+    results = {}
+    for name, function in benchmarks.items():
+        if pattern in name:
+            setup = None
+            if isinstance(function, tuple):
+                setup, function = function
+            results[name] = measure(function, setup=setup)
+            print(f"{name:<40} {results[name] * 1e6:12.1f} us", flush=True)
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    """
+    Compares results with a baseline.
+
+    Args:
+        results: The new timings.
+        baseline: The stored timings.
+        threshold: The slowdown ratio above which a benchmark is a regression.
+
+    Returns:
+        list: The names of the benchmarks that regressed.
+    """
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name]
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Board operations and the solver phases.")
+    parser.add_argument("--cycles", type=int, default=200, help="samples drawn by the sampling benchmarks")
+    parser.add_argument("--filter", default="", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results stored in this JSON file")
+    parser.add_argument("--save-baseline", help="store the results as the baseline in this JSON file")
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD, help="slowdown ratio counted as a regression"
+    )
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.cycles, args.filter)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cycles": args.cycles,
+        "corpusSeed": CORPUS_SEED,
+        "results": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("cycles") != args.cycles or baseline.get("corpusSeed") != CORPUS_SEED:
+            print("The baseline was recorded with other settings, the comparison is meaningless.")
+            sys.exit(2)
+        print()
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than {args.threshold}x the baseline.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
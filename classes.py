@@ -1,5 +1,7 @@
 import random
+from functools import lru_cache
 from colors import color as clr
+from placements import MAX_DEAD_ENDS, placement_table
 
 
 # Board class
@@ -12,6 +14,13 @@ class Board:
         2: clr.FAIL + "X" + clr.ENDC,
         3: clr.WARNING + "#" + clr.ENDC,
     }
+    # The printed pieces of the board, built once: each cell with the space after it
+    # and the selected cell in brackets (over the space before it). See layout for the labels
+    cellLabels: dict[int, str] = {cell: label + " " for cell, label in labels.items()}
+    selectedLabels: dict[int, str] = {
+        cell: f"\b{clr.BOLD+clr.HL}[{label}{clr.BOLD+clr.HL}]{clr.ENDC}" for cell, label in labels.items()
+    }
+    # The classic fleet, used when a board is created without one
     types: dict[str, int] = {
         "Destroyer": 2,
         "Submarine": 3,
@@ -20,16 +29,80 @@ class Board:
         "Carrier": 5,
     }
 
-    def __init__(self: "Board") -> None:
+    def __init__(self: "Board", width: int = 10, height: int = 10, types: "dict[str, int] | None" = None) -> None:
         """
         Initializes a new instance of the class.
 
-        The __init__ method is called when a new object of the class is created. It initializes the grid attribute as a 10x10 matrix filled with zeros and the ships attribute as an empty list.
+        The __init__ method is called when a new object of the class is created. It initializes the grid attribute as a height x width matrix filled with zeros and the ships attribute as an empty list.
+
+        Parameters:
+        - width (int): The number of columns. Default is 10.
+        - height (int): The number of rows. Default is 10.
+        - types (dict): The fleet, the length of each ship type. Default is the classic fleet of Board.types.
+
+        Attributes:
+        - width, height (int): The size of the board.
+        - types (dict): The fleet of the board.
+        - grid (list): The height x width board (0: empty, 1: miss, 2: hit).
+        - ships (list): The ships on the board.
+        - shipAt (dict): The ship covering each square that has one.
+        - remaining (dict): The number of squares of each ship that were not hit yet.
+        - shipsLeft (int): The number of ships that are not sunk yet.
         """
-        self.grid: list[list[int]] = [[0 for x in range(10)] for y in range(10)]
+        self.width: int = width
+        self.height: int = height
+        self.types: dict[str, int] = dict(Board.types if types is None else types)
+        self.grid: list[list[int]] = [[0 for x in range(width)] for y in range(height)]
         self.ships: list[Ship] = []
+        self.shipAt: dict[tuple[int, int], Ship] = {}
+        self.remaining: dict[Ship, int] = {}
+        self.shipsLeft: int = 0
 
-    def hit(self: "Board", square: tuple[int, int]) -> bool:
+    @staticmethod
+    def rowLabel(row: int) -> str:
+        """
+        Returns the label of a row: A to Z, then AA, AB and so on, like spreadsheet columns.
+
+        Parameters:
+        - row (int): The row number, from 0.
+        """
+        label = ""
+        row += 1
+        while row:
+            row, letter = divmod(row - 1, 26)
+            label = chr(letter + 65) + label
+        return label
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def layout(width: int, height: int) -> tuple[list[str], str]:
+        """
+        Returns the printed row labels and column header of a board size, built once per size.
+        Columns past 9 are numbered on two lines (tens above units), so every number fits over its cell.
+
+        Parameters:
+        - width, height (int): The size of the board.
+
+        Returns:
+        - (rowLabels, header): The label of each row with the space after it, and the header.
+        """
+        if width <= 10 and height <= 26:
+            # the classic layout, the 10 overflows past the last cell
+            return [f"{chr(i+65)} " for i in range(height)], "  " + " ".join(str(c + 1) for c in range(width)) + "\n"
+        labelWidth = len(Board.rowLabel(height - 1))
+        rowLabels = [Board.rowLabel(i).ljust(labelWidth) + " " for i in range(height)]
+        margin = " " * (labelWidth + 1)
+        tens = "".join(f"{(c + 1) // 10 % 10 if c + 1 >= 10 else ' '} " for c in range(width))
+        units = "".join(f"{(c + 1) % 10} " for c in range(width))
+        return rowLabels, margin + tens.rstrip() + "\n" + margin + units.rstrip() + "\n"
+
+    def fleet(self: "Board") -> tuple[tuple[str, int], ...]:
+        """
+        Returns the fleet of the board as (ship type, ship length) pairs, the key of its placement table.
+        """
+        return tuple(self.types.items())
+
+    def hit(self: "Board", square: tuple[int, int]) -> "HitResult":
         """
         Checks if the guess was a hit and updates the board accordingly.
 
@@ -37,19 +110,23 @@ class Board:
         - square (tuple): The coordinates of the square being guessed.
 
         Returns:
-        - bool: True if the guess was a hit, False otherwise.
-        """
-        gotHit: bool = False
-        for ship in self.ships:
-            if ship.isHit(square):
-                gotHit = True
-
-        if gotHit: # hit
-            self.grid[square[0]][square[1]] = 2
-            return True
-        else: # miss
-            self.grid[square[0]][square[1]] = 1
-            return False
+        - HitResult: The ship that was hit (if any) and whether this shot sunk it.
+          It is truthy for a hit and falsy for a miss.
+        """
+        r, c = square
+        ship = self.shipAt.get((r, c))
+        if ship is None: # miss
+            self.grid[r][c] = 1
+            return HitResult()
+        if self.grid[r][c] == 2: # hit again, nothing changes
+            return HitResult(ship)
+        # hit
+        self.grid[r][c] = 2
+        self.remaining[ship] -= 1
+        sunk = self.remaining[ship] == 0
+        if sunk:
+            self.shipsLeft -= 1
+        return HitResult(ship, sunk)
 
     def gameOver(self: "Board") -> bool:
         """
@@ -58,8 +135,23 @@ class Board:
         Returns:
         - bool: True if all ships are sunk, False otherwise.
         """
-        for ship in self.ships:
-            if not ship.isSunk(self):
+        return self.shipsLeft == 0
+
+    def isShipSunk(self: "Board", ship: "Ship") -> bool:
+        """
+        Checks if a ship on this board is sunk.
+
+        Parameters:
+        - ship (Ship): The ship to check.
+
+        Returns:
+        - bool: True if all squares of the ship are hit, False otherwise.
+        """
+        if ship in self.remaining:
+            return self.remaining[ship] == 0
+        # not placed on this board
+        for square in ship.squares:
+            if self.grid[square[0]][square[1]] != 2:
                 return False
         return True
 
@@ -74,46 +166,101 @@ class Board:
         - True if the ship was successfully placed, False otherwise.
         """
         for s in ship.squares:
-            if s[0] < 0 or s[0] > 9 or s[1] < 0 or s[1] > 9: # out of bounds
+            if s[0] < 0 or s[0] >= self.height or s[1] < 0 or s[1] >= self.width: # out of bounds
+                return False
+            if s in self.shipAt: # overlapping
                 return False
-            for otherShip in self.ships:
-                for otherSquare in otherShip.squares:
-                    if s == otherSquare: # overlapping
-                        return False
         self.ships.append(ship)
+        for s in ship.squares:
+            self.shipAt[s] = ship
+        self.remaining[ship] = sum([1 for s in ship.squares if self.grid[s[0]][s[1]] != 2])
+        if self.remaining[ship] > 0:
+            self.shipsLeft += 1
         return True
 
-    def placeShipRandom(self: "Board", shipType: str, triesLeft: int=100) -> bool:
+    def placeShipRandom(self: "Board", shipType: str, rng: "random.Random" = random) -> bool:
         """
         Places a ship on the board at random coordinates.
+        The position is drawn among the ones where the ship fits, each with the same chance,
+        so it never has to try again.
 
         Parameters:
-        - ship (Ship): The ship to place on the board.
+        - shipType (str): The type of the ship to place.
+        - rng (random.Random): The random generator to use. Default is the global one of the random module.
 
         Returns:
-        - True if the ship was successfully placed, False otherwise.
+        - True if the ship was successfully placed, False if it fits nowhere.
+        """
+        table = placement_table(self.width, self.height, self.fleet())
+        pid = table.random_placement(shipType, self.occupiedMask(), rng)
+        if pid is None:
+            return False
+        return self.placeShip(Ship(table.squares[pid], shipType))
+
+    def placeFleetRandom(self: "Board", rng: "random.Random" = random) -> bool:
         """
-        ship: "Ship" = Ship([(0, 0) for _ in range(Board.types[shipType])], shipType)
-
-        # Randomly choose the orientation of the ship
-        orientation: str = random.choice(["horizontal", "vertical"])
-        if orientation == "horizontal":
-            x: int = random.randint(0, 9 - len(ship.squares))
-            y: int = random.randint(0, 9)
-            for i in range(len(ship.squares)):
-                ship.squares[i] = (x + i, y)
-        else:
-            x: int = random.randint(0, 9)
-            y: int = random.randint(0, 9 - len(ship.squares))
-            for i in range(len(ship.squares)):
-                ship.squares[i] = (x, y + i)
-
-        if not self.placeShip(ship) and triesLeft > 0: # try again
-            return self.placeShipRandom(shipType, triesLeft - 1)
-        elif triesLeft == 0: # give up
+        Places every ship of the fleet (types) on the board at random coordinates (see PlacementTable.random_fleet).
+
+        Parameters:
+        - rng (random.Random): The random generator to use. Default is the global one of the random module.
+
+        Returns:
+        - True if the fleet was placed, False if it does not fit around the ships already on the board.
+        """
+        table = placement_table(self.width, self.height, self.fleet())
+        occupied = self.occupiedMask()
+        fleet = table.random_fleet(rng, occupied)
+        # a dead end is only possible if the board was crowded to begin with
+        for _ in range(MAX_DEAD_ENDS):
+            if fleet is not None:
+                break
+            fleet = table.random_fleet(rng, occupied)
+        if fleet is None:
             return False
+        for shipType, pid in zip(self.types, fleet):
+            self.placeShip(Ship(table.squares[pid], shipType))
         return True
 
+    def occupiedMask(self: "Board") -> int:
+        """
+        Returns the bitmask of the squares covered by a ship (bit row * width + col).
+        """
+        mask: int = 0
+        width = self.width
+        for s in self.shipAt:
+            mask |= 1 << (s[0] * width + s[1])
+        return mask
+
+    def shotMasks(self: "Board") -> tuple[int, int]:
+        """
+        Returns the bitmasks of the missed and hit squares (bit row * width + col).
+        """
+        width = self.width
+        misses: int = 0
+        hits: int = 0
+        for r, row in enumerate(self.grid):
+            for c, cell in enumerate(row):
+                if cell == 1:
+                    misses |= 1 << (r * width + c)
+                elif cell == 2:
+                    hits |= 1 << (r * width + c)
+        return misses, hits
+
+    def loadShots(self: "Board", misses: int, hits: int) -> None:
+        """
+        Replaces the shots on an empty board, as when it is loaded (see codec).
+        It must be called before the ships are placed, so they count the hits they already have.
+
+        Parameters:
+        - misses (int): Bitmask of the missed squares.
+        - hits (int): Bitmask of the hit squares.
+        """
+        width = self.width
+        self.grid = [
+            [2 if hits >> (r * width + c) & 1 else 1 if misses >> (r * width + c) & 1 else 0 for c in range(width)]
+            for r in range(self.height)
+        ]
+
     # Print the board
     def stringify(self: "Board", selected=None, drawShips: bool=True) -> str:
         """
@@ -134,55 +281,196 @@ class Board:
                     if numBoard[s[0]][s[1]] != 2:
                         numBoard[s[0]][s[1]] = 3
 
-        # draw the board
-        if selected is not None:
-            r,c = selected
-            printBoard: str = "  1 2 3 4 5 6 7 8 9 10\n" + clr.ENDC
-            for i, row in enumerate(numBoard):
-                printBoard += f"{chr(i+65)} "
-                for j, cell in enumerate(row):
-                    if (i, j) == (r, c):
-                        # if selected
-                        printBoard += f"\b{clr.BOLD+clr.HL}[{Board.labels[cell]}{clr.BOLD+clr.HL}]{clr.ENDC}"
-                    else:
-                        printBoard += f"{Board.labels[cell]}"
-                        # if j+1 != c or r != i:
-                        printBoard += " "
-                printBoard += "\n"
-        else:
-            # don't care about selected
-            printBoard = "  1 2 3 4 5 6 7 8 9 10\n" + "\n".join(
-                [
-                    f"{chr(i+65)} "
-                    + " ".join([Board.labels[cell] for cell in row])
-                    + " "
-                    for (i, row) in enumerate(numBoard)
-                ]
-            )
-
-        return printBoard
+        # draw the board, joining the cached pieces
+        cellLabels = Board.cellLabels
+        rowLabels, header = Board.layout(self.width, self.height)
+        rows = [rowLabels[i] + "".join([cellLabels[cell] for cell in row]) for i, row in enumerate(numBoard)]
+        if selected is None:
+            return header + "\n".join(rows)
+
+        r, c = selected
+        row = [cellLabels[cell] for cell in numBoard[r]]
+        row[c] = Board.selectedLabels[numBoard[r][c]]
+        rows[r] = rowLabels[r] + "".join(row)
+        return header + clr.ENDC + "\n".join(rows) + "\n"
 
     def __str__(self: "Board") -> str:
         return self.stringify(None)
 
 
+# Bitboard class
+class BitBoard(Board):
+    # Same rules and API as Board, but the board state is kept in integers
+    # with one bit per square (bit r * width + c for square (r, c)).
+    # This makes hit, sunk, game over and overlap checks a few bit operations,
+    # and keeps large boards small: a 100x100 board is three 10000-bit integers.
+
+    def __init__(self: "BitBoard", width: int = 10, height: int = 10, types: "dict[str, int] | None" = None) -> None:
+        """
+        Initializes a new instance of the class.
+
+        Parameters:
+        - width, height, types: See Board.
+
+        Attributes:
+        - width, height (int): The size of the board.
+        - types (dict): The fleet of the board.
+        - misses (int): Bitmask of the squares that were guessed and missed.
+        - hits (int): Bitmask of the squares that were guessed and hit.
+        - occupied (int): Bitmask of the squares covered by a ship.
+        - shipMasks (dict): The bitmask of each ship on the board.
+        - ships (list): The ships on the board.
+        - shipAt (dict): The ship covering each square that has one.
+        """
+        self.width: int = width
+        self.height: int = height
+        self.types: dict[str, int] = dict(Board.types if types is None else types)
+        self.misses: int = 0
+        self.hits: int = 0
+        self.occupied: int = 0
+        self.shipMasks: dict[Ship, int] = {}
+        self.ships: list[Ship] = []
+        self.shipAt: dict[tuple[int, int], Ship] = {}
+
+    def squareBit(self: "BitBoard", square: tuple[int, int]) -> int:
+        """
+        Returns the bit of a square.
+
+        Parameters:
+        - square (tuple): The coordinates of the square.
+
+        Returns:
+        - int: An integer with only the bit of the square set.
+        """
+        return 1 << (square[0] * self.width + square[1])
+
+    @property
+    def grid(self: "BitBoard") -> list[list[int]]:
+        """
+        A height x width view of the board in the same format as Board.grid (0: empty, 1: miss, 2: hit).
+        The view is rebuilt on every access, writing to it does not change the board.
+        """
+        width: int = self.width
+        hits: int = self.hits
+        misses: int = self.misses
+        return [
+            [
+                2 if hits >> (r * width + c) & 1 else 1 if misses >> (r * width + c) & 1 else 0
+                for c in range(width)
+            ]
+            for r in range(self.height)
+        ]
+
+    def hit(self: "BitBoard", square: tuple[int, int]) -> "HitResult":
+        """
+        Checks if the guess was a hit and updates the board accordingly.
+
+        Parameters:
+        - square (tuple): The coordinates of the square being guessed.
+
+        Returns:
+        - HitResult: The ship that was hit (if any) and whether this shot sunk it.
+        """
+        bit: int = 1 << (square[0] * self.width + square[1])
+        if self.occupied & bit: # hit
+            ship = self.shipAt[(square[0], square[1])]
+            mask = self.shipMasks[ship]
+            sunk = not self.hits & bit and (self.hits | bit) & mask == mask
+            self.hits |= bit
+            return HitResult(ship, sunk)
+        # miss
+        self.misses |= bit
+        return HitResult()
+
+    def occupiedMask(self: "BitBoard") -> int:
+        """
+        Returns the bitmask of the squares covered by a ship.
+        """
+        return self.occupied
+
+    def shotMasks(self: "BitBoard") -> tuple[int, int]:
+        """
+        Returns the bitmasks of the missed and hit squares.
+        """
+        return self.misses, self.hits
+
+    def loadShots(self: "BitBoard", misses: int, hits: int) -> None:
+        """
+        Replaces the shots on the board, as when it is loaded (see codec).
+        """
+        self.misses = misses
+        self.hits = hits
+
+    def gameOver(self: "BitBoard") -> bool:
+        """
+        Checks if the game is over.
+
+        Returns:
+        - bool: True if all ships are sunk, False otherwise.
+        """
+        return (self.occupied & ~self.hits) == 0
+
+    def isShipSunk(self: "BitBoard", ship: "Ship") -> bool:
+        """
+        Checks if a ship on this board is sunk.
+
+        Parameters:
+        - ship (Ship): The ship to check.
+
+        Returns:
+        - bool: True if all squares of the ship are hit, False otherwise.
+        """
+        mask: int = self.shipMasks.get(ship, 0)
+        if mask == 0: # not placed on this board
+            for s in ship.squares:
+                mask |= 1 << (s[0] * self.width + s[1])
+        return (self.hits & mask) == mask
+
+    def placeShip(self: "BitBoard", ship: "Ship") -> bool:
+        """
+        Places a ship on the board.
+
+        Parameters:
+        - ship (Ship): The ship to place on the board.
+
+        Returns:
+        - True if the ship was successfully placed, False otherwise.
+        """
+        mask: int = 0
+        width = self.width
+        for s in ship.squares:
+            if s[0] < 0 or s[0] >= self.height or s[1] < 0 or s[1] >= width: # out of bounds
+                return False
+            mask |= 1 << (s[0] * width + s[1])
+        if mask & self.occupied: # overlapping
+            return False
+        self.occupied |= mask
+        self.shipMasks[ship] = mask
+        self.ships.append(ship)
+        for s in ship.squares:
+            self.shipAt[s] = ship
+        return True
+
+
 # Ship class
 class Ship:
-    def __init__(self: "Ship", squares: list[tuple[int,int]], shipType: str) -> None:
+    # Ships never change once created, and there are many of them in the simulations
+    __slots__ = ("squares", "shipType")
+
+    def __init__(self: "Ship", squares: "list[tuple[int,int]] | frozenset[tuple[int, int]]", shipType: str) -> None:
         """
         Initializes a Ship object.
 
         Parameters:
-        - squares (list of tuples): The list of squares occupied by the ship.
+        - squares (list of tuples): The squares occupied by the ship.
         - shipType (string): The type of the ship.
 
         Attributes:
-        - squares (list of tuples): The list of squares occupied by the ship.
-        - sunk (bool): Indicates whether the ship is sunk or not.
+        - squares (frozenset of tuples): The squares occupied by the ship.
         - shipType (string): The type of the ship.
         """
-        self.squares = squares
-        self.shipType = shipType
+        self.squares: frozenset[tuple[int, int]] = frozenset(squares)
+        self.shipType: str = shipType
 
     def isSunk(self: "Ship", board: "Board") -> bool:
         """
@@ -191,10 +479,7 @@ class Ship:
         Returns:
         - True if all squares of the ship are hit, False otherwise.
         """
-        for square in self.squares:
-            if board.grid[square[0]][square[1]] != 2:
-                return False
-        return True
+        return board.isShipSunk(self)
 
     def isHit(self: "Ship", square: tuple[int, int]) -> bool:
         """
@@ -207,3 +492,36 @@ class Ship:
         - True if the square is hit, False otherwise.
         """
         return square in self.squares
+
+
+# Result of a shot
+class HitResult:
+    # What Board.hit found: a miss, a hit, or a hit that sunk a ship.
+    # It is truthy for a hit, so it can be used like the bool hit used to return.
+    __slots__ = ("ship", "sunk")
+
+    def __init__(self: "HitResult", ship: "Ship | None" = None, sunk: bool = False) -> None:
+        """
+        Initializes a HitResult object.
+
+        Parameters:
+        - ship (Ship): The ship that was hit, None for a miss.
+        - sunk (bool): True if this shot sunk the ship.
+        """
+        self.ship = ship
+        self.sunk = sunk
+
+    @property
+    def shipType(self: "HitResult") -> str | None:
+        """
+        The type of the ship that was hit, None for a miss.
+        """
+        return None if self.ship is None else self.ship.shipType
+
+    def __bool__(self: "HitResult") -> bool:
+        return self.ship is not None
+
+    def __repr__(self: "HitResult") -> str:
+        if self.ship is None:
+            return "HitResult(miss)"
+        return f"HitResult({'sunk' if self.sunk else 'hit'} {self.ship.shipType})"
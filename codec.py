@@ -0,0 +1,324 @@
+# Description: This file contains the compact binary format of boards and games.
+# A board is its size, its fleet (only if it is not the classic one), its shots packed at 2 bits per
+# square and its ships as (type, first square, direction): a classic 10x10 board takes 41 bytes and
+# a game (both boards and whose turn it is) 86. Everything is read straight from the buffer with
+# struct and memoryview, so records can be decoded from a larger buffer (a file, a pipe) without copies.
+#
+# Layout, all integers little-endian:
+#   game:   "BS", version (B), turn (B), then the boards one after the other
+#   board:  width (H), height (H), flags (B), ship count (B)
+#           [if FLAG_FLEET: type count (B), then for each type: length (B), name length (B), UTF-8 name]
+#           shots: ceil(2 * width * height / 8) bytes, square row * width + col in bits 2k and 2k + 1
+#                  (0: not guessed, 1: miss, 2: hit)
+#           ships: for each ship, its type index in the fleet (B) and its placement
+#                  (first square * 2 + 1 if it runs along a row), unsigned, in 1, 2 or 4 bytes
+#                  depending on the board size (see placement_format)
+from functools import lru_cache
+import struct
+# our own modules
+from classes import Board, Ship
+
+MAGIC = b"BS"
+VERSION = 1
+# The board's fleet is written out, it is not Board.types
+FLAG_FLEET = 1
+
+GAME_HEADER = struct.Struct("<2sBB")
+BOARD_HEADER = struct.Struct("<HHBB")
+
+
+@lru_cache(maxsize=None)
+def _patterns(bits: int) -> tuple[int, list[int]]:
+    # The masks that spread a bits-long integer to every other bit of 2 * bits (and back):
+    # pattern k has runs of k ones and k zeros, the classic Morton code steps for any length
+    span = 1
+    while span < bits:
+        span *= 2
+    total = 2 * span
+    ones = (1 << total) - 1
+    patterns = []
+    k = 1
+    while k <= span:
+        patterns.append(((1 << k) - 1) * (ones // ((1 << 2 * k) - 1)))
+        k *= 2
+    return span, patterns
+
+
+def _spread(mask: int, bits: int) -> int:
+    # Moves bit i of mask to bit 2i
+    span, patterns = _patterns(bits)
+    k = span // 2
+    for pattern in reversed(patterns[:-1]):
+        mask = (mask | mask << k) & pattern
+        k //= 2
+    return mask
+
+
+def _compact(mask: int, bits: int) -> int:
+    # Moves bit 2i of mask to bit i, the others are dropped (undoes _spread)
+    _, patterns = _patterns(bits)
+    mask &= patterns[0]
+    k = 1
+    for pattern in patterns[1:]:
+        mask = (mask | mask >> k) & pattern
+        k *= 2
+    return mask
+
+
+def shots_size(cells: int) -> int:
+    """
+    Returns the number of bytes of the packed shots of a board with this many squares.
+    """
+    return (2 * cells + 7) // 8
+
+
+def pack_shots(misses: int, hits: int, cells: int) -> bytes:
+    """
+    Packs the shots of a board at 2 bits per square.
+
+    Parameters:
+    - misses, hits (int): Bitmasks of the missed and hit squares.
+    - cells (int): The number of squares of the board.
+
+    Returns:
+    - bytes: shots_size(cells) bytes, square k in bits 2k (miss) and 2k + 1 (hit).
+    """
+    packed = _spread(misses, cells) | _spread(hits, cells) << 1
+    return packed.to_bytes(shots_size(cells), "little")
+
+
+def unpack_shots(data: "bytes | memoryview", cells: int) -> tuple[int, int]:
+    """
+    Unpacks shots packed by pack_shots.
+
+    Parameters:
+    - data (bytes or memoryview): The packed shots, shots_size(cells) bytes.
+    - cells (int): The number of squares of the board.
+
+    Returns:
+    - (misses, hits): Bitmasks of the missed and hit squares.
+    """
+    packed = int.from_bytes(data, "little")
+    return _compact(packed, cells), _compact(packed >> 1, cells)
+
+
+def uint_code(limit: int) -> str:
+    """
+    Returns the struct code of the smallest unsigned integer that holds every value below limit.
+    """
+    if limit <= 1 << 8:
+        return "B"
+    if limit <= 1 << 16:
+        return "H"
+    return "I"
+
+
+def placement_format(cells: int) -> struct.Struct:
+    """
+    Returns the format of one ship record on a board with this many squares:
+    the type index and the smallest unsigned integer that holds every placement.
+    """
+    return struct.Struct("<B" + uint_code(2 * cells))
+
+
+def encode_fleet(types: dict[str, int]) -> bytes:
+    """
+    Encodes a fleet: the type count, then the length and name of each type.
+    """
+    if len(types) > 255:
+        raise ValueError("at most 255 ship types can be encoded")
+    out = [bytes([len(types)])]
+    for ship_type, length in types.items():
+        name = ship_type.encode()
+        out.append(bytes([length, len(name)]) + name)
+    return b"".join(out)
+
+
+def decode_fleet(view: memoryview, offset: int) -> tuple[dict[str, int], int]:
+    """
+    Decodes a fleet encoded by encode_fleet.
+
+    Returns:
+    - (types, end): The length of each ship type and the offset just after the fleet.
+    """
+    types = {}
+    count = view[offset]
+    offset += 1
+    for _ in range(count):
+        length, size = view[offset], view[offset + 1]
+        types[str(view[offset + 2:offset + 2 + size], "utf-8")] = length
+        offset += 2 + size
+    return types, offset
+
+
+def ship_placement(ship: "Ship", width: int, length: int) -> int:
+    """
+    Returns the placement code of a ship: its first square * 2, + 1 if it runs along a row.
+
+    Parameters:
+    - ship (Ship): The ship.
+    - width (int): The width of its board.
+    - length (int): The length of its type.
+
+    Raises:
+    - ValueError: If the ship is not a straight line of that length.
+    """
+    r, c = min(ship.squares)
+    across = length > 1 and (r, c + 1) in ship.squares
+    if ship.squares != frozenset(_squares(r, c, across, length)):
+        raise ValueError(f"the {ship.shipType} is not a straight line of {length} squares")
+    return (r * width + c) * 2 + across
+
+
+def placement_ship(placement: int, width: int, ship_type: str, length: int) -> "Ship":
+    """
+    Returns the ship of a placement code (undoes ship_placement).
+    """
+    r, c = divmod(placement >> 1, width)
+    return Ship(_squares(r, c, bool(placement & 1), length), ship_type)
+
+
+def encode_board(board: "Board") -> bytes:
+    """
+    Encodes a board: its size, fleet, shots and ships.
+
+    Parameters:
+    - board (Board): The board, a Board or a BitBoard.
+
+    Returns:
+    - bytes: The record.
+
+    Raises:
+    - ValueError: If a ship is not a straight line of its type's length, or the fleet or
+      ships do not fit the format (255 of each at most).
+    """
+    width, height = board.width, board.height
+    fleet = list(board.types.items())
+    if len(board.ships) > 255:
+        raise ValueError("at most 255 ships can be encoded")
+    index = {ship_type: i for i, (ship_type, _) in enumerate(fleet)}
+    custom = fleet != list(Board.types.items())
+
+    out = [BOARD_HEADER.pack(width, height, FLAG_FLEET if custom else 0, len(board.ships))]
+    if custom:
+        out.append(encode_fleet(board.types))
+    misses, hits = board.shotMasks()
+    out.append(pack_shots(misses, hits, width * height))
+
+    record = placement_format(width * height)
+    for ship in board.ships:
+        if ship.shipType not in index:
+            raise ValueError(f"{ship.shipType} is not in the fleet of the board")
+        placement = ship_placement(ship, width, board.types[ship.shipType])
+        out.append(record.pack(index[ship.shipType], placement))
+    return b"".join(out)
+
+
+def _squares(r: int, c: int, across: bool, length: int) -> list[tuple[int, int]]:
+    # The squares of a ship from its first square and direction
+    if across:
+        return [(r, c + i) for i in range(length)]
+    return [(r + i, c) for i in range(length)]
+
+
+def decode_board(
+    data: "bytes | bytearray | memoryview", offset: int = 0, engine: type = Board
+) -> tuple["Board", int]:
+    """
+    Decodes a board encoded by encode_board.
+
+    Parameters:
+    - data (bytes, bytearray or memoryview): The buffer the record is in. It is not copied.
+    - offset (int): Where the record starts in data.
+    - engine (type): The board class to create (Board or BitBoard).
+
+    Returns:
+    - (board, end): The board and the offset just after the record, where the next one starts.
+
+    Raises:
+    - ValueError: If a ship is out of bounds or overlaps another one.
+    """
+    view = memoryview(data)
+    width, height, flags, ship_count = BOARD_HEADER.unpack_from(view, offset)
+    offset += BOARD_HEADER.size
+
+    types = None
+    if flags & FLAG_FLEET:
+        types, offset = decode_fleet(view, offset)
+    board = engine(width, height, types)
+    fleet = list(board.types.items())
+
+    cells = width * height
+    end = offset + shots_size(cells)
+    board.loadShots(*unpack_shots(view[offset:end], cells))
+    offset = end
+
+    record = placement_format(cells)
+    for type_index, placement in record.iter_unpack(view[offset:offset + ship_count * record.size]):
+        ship_type, length = fleet[type_index]
+        if not board.placeShip(placement_ship(placement, width, ship_type, length)):
+            raise ValueError(f"the {ship_type} does not fit on the board")
+    return board, offset + ship_count * record.size
+
+
+def encode_game(boards: "list[Board]", turn: int) -> bytes:
+    """
+    Encodes a game: every board and whose turn it is.
+
+    Parameters:
+    - boards (list): The boards of the players, in order.
+    - turn (int): The index of the player whose turn it is.
+
+    Returns:
+    - bytes: The record.
+    """
+    return GAME_HEADER.pack(MAGIC, VERSION, turn) + b"".join(encode_board(board) for board in boards)
+
+
+def decode_game(
+    data: "bytes | bytearray | memoryview", players: int = 2, offset: int = 0, engine: type = Board
+) -> tuple[list["Board"], int, int]:
+    """
+    Decodes a game encoded by encode_game.
+
+    Parameters:
+    - data (bytes, bytearray or memoryview): The buffer the record is in. It is not copied.
+    - players (int): The number of boards in the game.
+    - offset (int): Where the record starts in data.
+    - engine (type): The board class to create (Board or BitBoard).
+
+    Returns:
+    - (boards, turn, end): The boards, whose turn it is and the offset just after the record.
+
+    Raises:
+    - ValueError: If the data is not a game record of this version.
+    """
+    magic, version, turn = GAME_HEADER.unpack_from(data, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a game record of this version")
+    offset += GAME_HEADER.size
+    boards = []
+    for _ in range(players):
+        board, offset = decode_board(data, offset, engine)
+        boards.append(board)
+    return boards, turn, offset
+
+
+def save_game(path: str, boards: "list[Board]", turn: int) -> None:
+    """
+    Saves a game to a file (see encode_game).
+    """
+    with open(path, "wb") as f:
+        f.write(encode_game(boards, turn))
+
+
+def load_game(path: str, players: int = 2, engine: type = Board) -> tuple[list["Board"], int]:
+    """
+    Loads a game saved by save_game.
+
+    Returns:
+    - (boards, turn): The boards and whose turn it is.
+    """
+    with open(path, "rb") as f:
+        boards, turn, _ = decode_game(f.read(), players, engine=engine)
+    return boards, turn
@@ -0,0 +1,316 @@
+# Description: This file contains the precomputed ship placement tables used by the solver
+# and the random fleet generator.
+from array import array
+from functools import lru_cache
+from typing import Callable
+import random
+
+# Tables whose per-square bitsets would take more bits than this in total build them lazily,
+# one square or placement at a time, instead of all at once (which grows quadratically with the board)
+EAGER_INDEX_BITS = 50_000_000
+# A fleet is given up on after this many dead ends in a row (see random_fleets):
+# with a fleet that fits at all, that many in a row is practically impossible
+MAX_DEAD_ENDS = 100
+
+
+class LazyIndex:
+    # A read-only list whose items are built on first access.
+    # Used for the bitset indexes of large tables, where most items are never needed.
+
+    def __init__(self: "LazyIndex", length: int, build: "Callable[[int], int]") -> None:
+        self._items: list[int | None] = [None] * length
+        self._build = build
+
+    def __len__(self: "LazyIndex") -> int:
+        return len(self._items)
+
+    def __getitem__(self: "LazyIndex", i: int) -> int:
+        item = self._items[i]
+        if item is None:
+            item = self._items[i] = self._build(i)
+        return item
+
+
+class PlacementTable:
+    # Every way a ship of each length can lie on the board.
+    # A placement is identified by an integer id, squares are numbered row * width + col.
+    # Ship types with the same length share the same placement ids.
+
+    def __init__(
+        self: "PlacementTable", width: int, height: int, fleet: tuple[tuple[str, int], ...]
+    ) -> None:
+        """
+        Enumerates all placements for a board size and fleet.
+
+        Parameters:
+        - width, height (int): The number of columns and rows of the board.
+        - fleet (tuple): (ship type, ship length) pairs, like Board.types.items().
+
+        Attributes:
+        - squares (list): The squares covered by each placement id.
+        - masks (list): The bitmask of the squares covered by each placement id.
+        - ids (dict): The range of placement ids available to each ship type.
+        - cell_ids (list): For each square, the placement ids covering it.
+        - cell_bits (list): For each square, a bitset of the placement ids covering it.
+        - conflicts (list): For each placement id, a bitset of the placement ids overlapping it (itself included).
+        - type_bits (dict): For each ship type, the bitset of its placement ids.
+        On large tables cell_bits and conflicts are LazyIndex objects, built item by item.
+        """
+        self.width: int = width
+        self.height: int = height
+        self.fleet: tuple[tuple[str, int], ...] = fleet
+        self.squares: list[tuple[tuple[int, int], ...]] = []
+        self.masks: list[int] = []
+        self.ids: dict[str, range] = {}
+        self.cell_ids: list[list[int]] = [[] for _ in range(width * height)]
+
+        by_length: dict[int, range] = {}
+        for ship_type, ship_length in fleet:
+            if ship_length not in by_length:
+                by_length[ship_length] = self._enumerate(ship_length)
+            self.ids[ship_type] = by_length[ship_length]
+
+        self.lazy: bool = len(self.masks) * width * height > EAGER_INDEX_BITS
+        if self.lazy:
+            self.cell_bits: "list[int] | LazyIndex" = LazyIndex(width * height, self._cell_bits)
+        else:
+            self.cell_bits = [self._cell_bits(cell) for cell in range(width * height)]
+        self._conflicts: "list[int] | LazyIndex | None" = None
+        self.type_bits: dict[str, int] = {
+            ship_type: (1 << ids.stop) - (1 << ids.start) for ship_type, ids in self.ids.items()
+        }
+        self._longest_first = sorted(range(len(fleet)), key=lambda i: -fleet[i][1])
+
+    def _enumerate(self: "PlacementTable", ship_length: int) -> range:
+        """
+        Adds every placement of a ship length to the table.
+
+        Parameters:
+        - ship_length (int): The length of the ship.
+
+        Returns:
+        - range: The placement ids that were added.
+        """
+        width = self.width
+        start = len(self.masks)
+        # For each square, for each orientation
+        for x in range(self.height):
+            for y in range(width):
+                for orientation in ["horizontal", "vertical"]:
+                    if orientation == "horizontal":
+                        if x + ship_length > self.height:
+                            continue
+                        pos = tuple((x + i, y) for i in range(ship_length))
+                    else:
+                        if y + ship_length > width:
+                            continue
+                        pos = tuple((x, y + i) for i in range(ship_length))
+
+                    pid = len(self.masks)
+                    mask = 0
+                    for s in pos:
+                        cell = s[0] * width + s[1]
+                        mask |= 1 << cell
+                        self.cell_ids[cell].append(pid)
+                    self.squares.append(pos)
+                    self.masks.append(mask)
+        return range(start, len(self.masks))
+
+    def _cell_bits(self: "PlacementTable", cell: int) -> int:
+        # The bitset of the placement ids covering a square
+        bits = 0
+        for pid in self.cell_ids[cell]:
+            bits |= 1 << pid
+        return bits
+
+    def _conflict(self: "PlacementTable", pid: int) -> int:
+        # The bitset of the placement ids overlapping a placement
+        overlap = 0
+        for s in self.squares[pid]:
+            overlap |= self.cell_bits[s[0] * self.width + s[1]]
+        return overlap
+
+    @property
+    def conflicts(self: "PlacementTable") -> "list[int] | LazyIndex":
+        """
+        The conflict index, built on first use (see build_conflicts).
+        On large tables only the placements that are looked up are built.
+        """
+        if self._conflicts is None:
+            if self.lazy:
+                self._conflicts = LazyIndex(len(self.masks), self._conflict)
+            else:
+                self._conflicts = self.build_conflicts()
+        return self._conflicts
+
+    def build_conflicts(self: "PlacementTable") -> list[int]:
+        """
+        Builds the whole conflict index: two placements overlap if they share a square.
+
+        Returns:
+        - list: For each placement id, a bitset of the placement ids overlapping it (itself included).
+        """
+        return [self._conflict(pid) for pid in range(len(self.masks))]
+
+    def live(self: "PlacementTable", miss_mask: int) -> dict[str, list[int]]:
+        """
+        Returns the placements of each ship type that do not touch a miss.
+
+        Parameters:
+        - miss_mask (int): Bitmask of the missed squares.
+
+        Returns:
+        - dict: For each ship type, the list of placement ids still possible.
+        """
+        # Placements covering any missed square are dead
+        dead = set()
+        while miss_mask:
+            low = miss_mask & -miss_mask
+            dead.update(self.cell_ids[low.bit_length() - 1])
+            miss_mask ^= low
+        # Ship types of the same length share their ids, filter each range once
+        by_ids: dict[range, list[int]] = {}
+        for ids in self.ids.values():
+            if ids not in by_ids:
+                by_ids[ids] = [pid for pid in ids if pid not in dead]
+        return {ship_type: list(by_ids[ids]) for ship_type, ids in self.ids.items()}
+
+    def bitset(self: "PlacementTable", pids: "list[int]") -> int:
+        """
+        Returns the bitset of some placement ids.
+        It is built in one pass over a byte array: adding the bits one by one would copy the
+        growing integer every time, which is quadratic on large tables.
+        """
+        packed = bytearray((len(self.masks) + 7) // 8)
+        for pid in pids:
+            packed[pid >> 3] |= 1 << (pid & 7)
+        return int.from_bytes(packed, "little")
+
+    def blocked(self: "PlacementTable", occupied: int) -> int:
+        """
+        Returns the bitset of the placement ids covering any of the occupied squares.
+
+        Parameters:
+        - occupied (int): Bitmask of the squares.
+        """
+        blocked = 0
+        while occupied:
+            low = occupied & -occupied
+            blocked |= self.cell_bits[low.bit_length() - 1]
+            occupied ^= low
+        return blocked
+
+    @staticmethod
+    def select(free: int, k: int) -> int:
+        """
+        Returns the k-th (from 0) placement id of a bitset, in increasing order.
+
+        Parameters:
+        - free (int): The bitset, with more than k ids.
+        - k (int): The rank of the id.
+        """
+        # Binary search for the lowest pid with more than k ids up to it
+        lo, hi = (free & -free).bit_length() - 1, free.bit_length() - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if (free & ((2 << mid) - 1)).bit_count() > k:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _draw(self: "PlacementTable", ship_type: str, blocked: int, rng: "random.Random") -> int | None:
+        # Draws one of the placement ids of a ship type that are not blocked, each with the same chance
+        free = self.type_bits[ship_type] & ~blocked
+        count = free.bit_count()
+        if not count:
+            return None
+        return self.select(free, rng.randrange(count))
+
+    def random_placement(
+        self: "PlacementTable", ship_type: str, occupied: int = 0, rng: "random.Random" = random
+    ) -> int | None:
+        """
+        Draws a placement of a ship type among the ones that fit, each with the same chance.
+
+        Parameters:
+        - ship_type (str): The type of the ship.
+        - occupied (int): Bitmask of the squares already taken by other ships.
+        - rng (random.Random): The random generator to use.
+
+        Returns:
+        - int: The placement id, or None if the ship fits nowhere.
+        """
+        return self._draw(ship_type, self.blocked(occupied), rng)
+
+    def random_fleet(
+        self: "PlacementTable", rng: "random.Random" = random, occupied: int = 0
+    ) -> list[int] | None:
+        """
+        Draws a placement for every ship of the fleet, each one among the placements that fit
+        the ships drawn before it, so no placement is ever rejected. The longest ships are drawn first,
+        which leaves the most room for the others. If a ship fits nowhere the whole fleet is a dead
+        end, and it is up to the caller to draw again.
+
+        Parameters:
+        - rng (random.Random): The random generator to use.
+        - occupied (int): Bitmask of squares that are already taken.
+
+        Returns:
+        - list: The placement id of each ship, in fleet order. None if a ship fits nowhere
+          (practically impossible with the classic fleet, possible with crowded fleets).
+        """
+        blocked = self.blocked(occupied)
+        cell_bits = self.cell_bits
+        width = self.width
+        selected = [0] * len(self.fleet)
+        for i in self._longest_first:
+            pid = self._draw(self.fleet[i][0], blocked, rng)
+            if pid is None:
+                return None
+            selected[i] = pid
+            for s in self.squares[pid]:
+                blocked |= cell_bits[s[0] * width + s[1]]
+        return selected
+
+    def random_fleets(self: "PlacementTable", count: int, rng: "random.Random" = random) -> array | None:
+        """
+        Draws many random fleets at once (see random_fleet). Dead ends are drawn again,
+        up to MAX_DEAD_ENDS in a row.
+
+        Parameters:
+        - count (int): The number of fleets.
+        - rng (random.Random): The random generator to use.
+
+        Returns:
+        - array: count * len(fleet) placement ids (unsigned 16-bit, or 32-bit for tables with more
+          placements), fleet after fleet, each in fleet order. Fleet k is fleets[k * len(fleet):(k + 1) * len(fleet)].
+          None if MAX_DEAD_ENDS fleets in a row were dead ends: the fleet (practically) does not fit the board.
+        """
+        fleets = array("H" if len(self.masks) <= 1 << 16 else "I")
+        dead_ends = 0
+        while len(fleets) < count * len(self.fleet):
+            selected = self.random_fleet(rng)
+            if selected is None:
+                dead_ends += 1
+                if dead_ends >= MAX_DEAD_ENDS:
+                    return None
+                continue
+            dead_ends = 0
+            fleets.extend(selected)
+        return fleets
+
+
+@lru_cache(maxsize=None)
+def placement_table(width: int, height: int, fleet: tuple[tuple[str, int], ...]) -> PlacementTable:
+    """
+    Returns the placement table for a board size and fleet, building it only once.
+
+    Parameters:
+    - width, height (int): The number of columns and rows of the board.
+    - fleet (tuple): (ship type, ship length) pairs, like Board.types.items().
+
+    Returns:
+    - PlacementTable: The shared table. It must not be modified.
+    """
+    return PlacementTable(width, height, fleet)
@@ -0,0 +1,178 @@
+# Description: This file contains the differential terminal renderer.
+# The game prints every screen from scratch. Instead of clearing the terminal and reprinting it all,
+# the output is written to a virtual screen, which is compared with the last frame that was shown:
+# only the cells that changed are sent to the terminal, with ANSI cursor moves in between.
+from contextlib import contextmanager, redirect_stdout
+import shutil # needed for the terminal height
+import sys # needed for the real standard output
+
+ESC = "\033["
+RESET = ESC + "0m"
+# Unchanged cells between two changes are rewritten if there are at most this many,
+# a cursor move costs about as many bytes
+MAX_GAP = 4
+
+
+class Screen:
+    # A virtual terminal that understands what the game prints: text, "\n", "\r", "\b"
+    # and color codes (SGR sequences). It is file-like, so print can write to it.
+
+    def __init__(self: "Screen", out=None) -> None:
+        """
+        Creates an empty screen.
+
+        Parameters:
+        - out: The real output, sys.stdout by default.
+
+        Attributes:
+        - cells (list): The current frame, for each row the (character, style) of each column.
+        - shown (list): The frame the terminal is showing, None if it is unknown.
+        - row, col (int): The cursor.
+        - style (str): The color codes applied to the next characters.
+        """
+        self.out = sys.stdout if out is None else out
+        self.cells: list[list[tuple[str, str]]] = [[]]
+        self.shown: list[list[tuple[str, str]]] | None = None
+        self.row = 0
+        self.col = 0
+        self.style = ""
+
+    def clear(self: "Screen") -> None:
+        """
+        Starts a new frame on a blank screen. Nothing is sent until render.
+        """
+        self.cells = [[]]
+        self.row = 0
+        self.col = 0
+        self.style = ""
+
+    def write(self: "Screen", text: str) -> int:
+        """
+        Writes text to the current frame, like a terminal would show it.
+
+        Parameters:
+        - text (str): The text, with color codes.
+
+        Returns:
+        - int: The number of characters written (as for a file).
+        """
+        i = 0
+        while i < len(text):
+            char = text[i]
+            if char == ESC[0] and text.startswith(ESC, i):
+                # A control sequence runs up to its final letter
+                end = i + 2
+                while end < len(text) and not text[end].isalpha():
+                    end += 1
+                if end < len(text) and text[end] == "m":
+                    code = text[i:end + 1]
+                    self.style = "" if code in (RESET, ESC + "m") else self.style + code
+                i = end + 1
+                continue
+            if char == "\n":
+                self.row += 1
+                self.col = 0
+            elif char == "\r":
+                self.col = 0
+            elif char == "\b":
+                self.col = max(0, self.col - 1)
+            else:
+                while len(self.cells) <= self.row:
+                    self.cells.append([])
+                line = self.cells[self.row]
+                while len(line) < self.col:
+                    line.append((" ", ""))
+                if self.col < len(line):
+                    line[self.col] = (char, self.style)
+                else:
+                    line.append((char, self.style))
+                self.col += 1
+            i += 1
+        while len(self.cells) <= self.row:
+            self.cells.append([])
+        return len(text)
+
+    def flush(self: "Screen") -> None:
+        # print(flush=True) flushes its file, a frame is only shown by render
+        pass
+
+    def render(self: "Screen") -> None:
+        """
+        Shows the current frame: sends the changes since the last frame to the terminal.
+        """
+        cells = self.cells
+        # Strip trailing blank rows, they look the same as no rows
+        height = len(cells)
+        while height > 1 and not cells[height - 1]:
+            height -= 1
+        if height > shutil.get_terminal_size().lines - 1:
+            # The frame scrolls, so positions on the screen are unknown: print it all
+            out = [ESC + "H" + ESC + "2J"]
+            for r in range(height):
+                out.append(self._draw(cells[r], 0, len(cells[r])) + RESET + "\r\n")
+            self.out.write("".join(out))
+            self.out.flush()
+            self.shown = None
+            return
+
+        shown = self.shown
+        out = []
+        if shown is None:
+            out.append(ESC + "H" + ESC + "2J")
+            shown = []
+        for r in range(max(height, len(shown))):
+            new = cells[r] if r < height else []
+            old = shown[r] if r < len(shown) else []
+            out.extend(self._diff(r, new, old))
+        if out:
+            # Leave the terminal's cursor where the virtual one is
+            out.append(f"{RESET}{ESC}{self.row + 1};{self.col + 1}H")
+            self.out.write("".join(out))
+            self.out.flush()
+        self.shown = [list(line) for line in cells[:height]]
+
+    def _diff(self: "Screen", r: int, new: list[tuple[str, str]], old: list[tuple[str, str]]) -> list[str]:
+        # Returns the output that turns the old row r into the new one
+        out = []
+        c = 0
+        while c < len(new):
+            if c < len(old) and new[c] == old[c]:
+                c += 1
+                continue
+            # Extend the run of changed cells over short unchanged gaps
+            end = c + 1
+            gap = 0
+            while end < len(new) and gap <= MAX_GAP:
+                if end < len(old) and new[end] == old[end]:
+                    gap += 1
+                else:
+                    gap = 0
+                end += 1
+            end -= gap
+            out.append(f"{ESC}{r + 1};{c + 1}H" + self._draw(new, c, end))
+            c = end
+        if len(old) > len(new):
+            # Erase the rest of the old row
+            out.append(f"{ESC}{r + 1};{len(new) + 1}H{RESET}{ESC}K")
+        return out
+
+    @staticmethod
+    def _draw(line: list[tuple[str, str]], start: int, end: int) -> str:
+        # Returns the characters of a row from start to end, switching colors as needed
+        text = []
+        style = None
+        for char, cellStyle in line[start:end]:
+            if cellStyle != style:
+                text.append(RESET + cellStyle)
+                style = cellStyle
+            text.append(char)
+        return "".join(text)
+
+    @contextmanager
+    def frame(self: "Screen"):
+        """
+        Captures everything printed inside the with block in the current frame, then shows it.
+        """
+        with redirect_stdout(self):
+            yield self
+        self.render()
@@ -0,0 +1,376 @@
+# Description: This file contains the replay log: an append-only binary file of finished games.
+# A log holds games of one board size and fleet. Every game record has the same size, so game i is at
+# a known offset: the reader memory-maps the file and decodes only the records it is asked for, and
+# millions of games can be scanned without reading the file into memory or parsing text.
+#
+# Layout, all integers little-endian (see codec for the fleet and the ship placements):
+#   header: "BSR", version (B), width (H), height (H), players (B), flags (B)
+#           [if codec.FLAG_FLEET: the fleet]
+#   game:   seed (Q), winner (B, NO_WINNER if unfinished), first player (B), shot count (I),
+#           the placement of every ship of every player, in fleet order,
+#           then players * width * height shots (squares row * width + col), padded with zeros
+# Players fire in turn, starting with the first player, each at the board of the next player.
+import mmap
+import struct
+from typing import Iterator
+# our own modules
+from classes import Board, HitResult, Ship
+import codec
+
+MAGIC = b"BSR"
+VERSION = 1
+# The winner of a game that was not played to the end
+NO_WINNER = 255
+
+LOG_HEADER = struct.Struct("<3sBHHBB")
+GAME_HEADER = struct.Struct("<QBBI")
+
+
+class Replay:
+    # One recorded game: the fleets of the players and every shot, in order.
+    __slots__ = ("width", "height", "types", "seed", "winner", "first", "layouts", "shots")
+
+    def __init__(
+        self: "Replay",
+        width: int,
+        height: int,
+        types: dict[str, int],
+        seed: int,
+        winner: int | None,
+        first: int,
+        layouts: list[list["Ship"]],
+        shots: list[tuple[int, int]],
+    ) -> None:
+        """
+        Initializes a Replay object.
+
+        Parameters:
+        - width, height, types: The size and fleet of the boards.
+        - seed (int): The seed the game was played with (0 if it has none).
+        - winner (int): The index of the player who won, None if the game was not finished.
+        - first (int): The index of the player who fired first.
+        - layouts (list): The ships of each player.
+        - shots (list): The squares fired at, in order.
+        """
+        self.width = width
+        self.height = height
+        self.types = types
+        self.seed = seed
+        self.winner = winner
+        self.first = first
+        self.layouts = layouts
+        self.shots = shots
+
+    def shooter(self: "Replay", step: int) -> int:
+        """
+        Returns the index of the player who fired shot number step (from 0).
+        """
+        return (self.first + step) % len(self.layouts)
+
+    def boards(self: "Replay", engine: type = Board) -> list["Board"]:
+        """
+        Returns the boards of the players before the first shot.
+
+        Parameters:
+        - engine (type): The board class to create (Board or BitBoard).
+        """
+        boards = []
+        for ships in self.layouts:
+            board = engine(self.width, self.height, self.types)
+            for ship in ships:
+                board.placeShip(ship)
+            boards.append(board)
+        return boards
+
+    def states(self: "Replay", engine: type = Board) -> Iterator[tuple[int, list["Board"], tuple[int, int], "HitResult"]]:
+        """
+        Replays the game shot by shot.
+
+        Parameters:
+        - engine (type): The board class to create (Board or BitBoard).
+
+        Yields:
+        - (shooter, boards, square, result): After each shot, the player who fired, the boards
+          (the same objects every time, updated in place), the square and the result of Board.hit.
+        """
+        boards = self.boards(engine)
+        for step, square in enumerate(self.shots):
+            shooter = self.shooter(step)
+            result = boards[(shooter + 1) % len(boards)].hit(square)
+            yield shooter, boards, square, result
+
+    def __repr__(self: "Replay") -> str:
+        winner = "unfinished" if self.winner is None else f"player {self.winner + 1} won"
+        return f"Replay({self.width}x{self.height}, {len(self.shots)} shots, {winner})"
+
+
+class ReplayFormat:
+    # The record layout of the games of one board size, fleet and number of players.
+
+    def __init__(
+        self: "ReplayFormat", width: int = 10, height: int = 10, types: dict[str, int] | None = None, players: int = 2
+    ) -> None:
+        """
+        Computes the layout of a game record.
+
+        Parameters:
+        - width, height, types: The size and fleet of the boards, see Board.
+        - players (int): The number of players.
+
+        Attributes:
+        - header (bytes): The header of a log of these games.
+        - record_size (int): The size of every game record.
+        """
+        self.width = width
+        self.height = height
+        self.types: dict[str, int] = dict(Board.types if types is None else types)
+        self.players = players
+        cells = width * height
+        self.fleet = list(self.types.items())
+        custom = self.fleet != list(Board.types.items())
+        self.header: bytes = LOG_HEADER.pack(
+            MAGIC, VERSION, width, height, players, codec.FLAG_FLEET if custom else 0
+        ) + (codec.encode_fleet(self.types) if custom else b"")
+        self.layouts = struct.Struct(f"<{players * len(self.fleet)}{codec.uint_code(2 * cells)}")
+        self.max_shots = players * cells
+        self.square_code = codec.uint_code(cells)
+        self.square_size = struct.calcsize(self.square_code)
+        self.record_size: int = GAME_HEADER.size + self.layouts.size + self.max_shots * self.square_size
+
+    def encode(
+        self: "ReplayFormat",
+        boards: list["Board"],
+        shots: list[tuple[int, int]],
+        first: int = 0,
+        winner: int | None = None,
+        seed: int = 0,
+    ) -> bytes:
+        """
+        Encodes a game.
+
+        Parameters:
+        - boards (list): The boards of the players, with their whole fleet placed.
+        - shots (list): The squares fired at, in order, starting with the first player.
+        - first (int): The index of the player who fired first.
+        - winner (int): The index of the player who won, None if the game was not finished.
+        - seed (int): The seed the game was played with, if any.
+
+        Returns:
+        - bytes: The record, record_size bytes.
+
+        Raises:
+        - ValueError: If the boards do not have this size and fleet, with every ship placed once.
+        """
+        if len(boards) != self.players or len(shots) > self.max_shots:
+            raise ValueError("the game does not fit this replay format")
+        placements = []
+        for board in boards:
+            if (board.width, board.height, list(board.types.items())) != (self.width, self.height, self.fleet):
+                raise ValueError("the board does not have the size and fleet of the replay log")
+            ships = {ship.shipType: ship for ship in board.ships}
+            if len(ships) != len(board.ships) or len(ships) != len(self.fleet):
+                raise ValueError("every ship of the fleet must be placed exactly once")
+            for ship_type, length in self.fleet:
+                placements.append(codec.ship_placement(ships[ship_type], self.width, length))
+
+        squares = [r * self.width + c for r, c in shots]
+        squares.extend([0] * (self.max_shots - len(squares)))
+        return b"".join((
+            GAME_HEADER.pack(seed, NO_WINNER if winner is None else winner, first, len(shots)),
+            self.layouts.pack(*placements),
+            struct.pack(f"<{self.max_shots}{self.square_code}", *squares),
+        ))
+
+    def decode(self: "ReplayFormat", view: "bytes | memoryview", offset: int = 0) -> "Replay":
+        """
+        Decodes a game record.
+
+        Parameters:
+        - view (bytes or memoryview): The buffer the record is in. It is not copied.
+        - offset (int): Where the record starts.
+
+        Returns:
+        - Replay: The game.
+        """
+        seed, winner, first, count = GAME_HEADER.unpack_from(view, offset)
+        offset += GAME_HEADER.size
+        placements = self.layouts.unpack_from(view, offset)
+        offset += self.layouts.size
+        squares = struct.unpack_from(f"<{count}{self.square_code}", view, offset)
+
+        fleet = self.fleet
+        layouts = [
+            [
+                codec.placement_ship(placements[p * len(fleet) + i], self.width, ship_type, length)
+                for i, (ship_type, length) in enumerate(fleet)
+            ]
+            for p in range(self.players)
+        ]
+        shots = [divmod(square, self.width) for square in squares]
+        return Replay(
+            self.width, self.height, self.types, seed, None if winner == NO_WINNER else winner, first, layouts, shots
+        )
+
+    @staticmethod
+    def read_header(view: "bytes | memoryview") -> tuple["ReplayFormat", int]:
+        """
+        Reads the header of a log.
+
+        Returns:
+        - (format, size): The format of the games of the log and the size of the header.
+
+        Raises:
+        - ValueError: If the data is not a replay log of this version.
+        """
+        view = memoryview(view)
+        magic, version, width, height, players, flags = LOG_HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a replay log of this version")
+        offset = LOG_HEADER.size
+        types = None
+        if flags & codec.FLAG_FLEET:
+            types, offset = codec.decode_fleet(view, offset)
+        return ReplayFormat(width, height, types, players), offset
+
+
+class ReplayLog:
+    # Appends games to a log file, creating it if needed. Records are only ever added at the end.
+
+    def __init__(
+        self: "ReplayLog", path: str, width: int = 10, height: int = 10, types: dict[str, int] | None = None, players: int = 2
+    ) -> None:
+        """
+        Opens a log for appending. A record cut short at the end of an existing log, by a writer
+        that crashed, is cut off, so the games appended after it start where the reader expects them.
+
+        Parameters:
+        - path (str): The log file.
+        - width, height, types, players: The games of the log, see ReplayFormat. An existing
+          log must have been created with the same ones.
+
+        Raises:
+        - ValueError: If the existing log holds other games.
+        """
+        self.format = ReplayFormat(width, height, types, players)
+        self._file = open(path, "ab")
+        size = self._file.tell()
+        if size == 0:
+            self._file.write(self.format.header)
+        else:
+            with open(path, "rb") as f:
+                if f.read(len(self.format.header)) != self.format.header:
+                    self._file.close()
+                    raise ValueError("the replay log holds games of another size, fleet or version")
+            start = len(self.format.header)
+            end = start + (size - start) // self.format.record_size * self.format.record_size
+            if end != size:
+                self._file.truncate(end)
+
+    def append(
+        self: "ReplayLog",
+        boards: list["Board"],
+        shots: list[tuple[int, int]],
+        first: int = 0,
+        winner: int | None = None,
+        seed: int = 0,
+    ) -> None:
+        """
+        Appends a game (see ReplayFormat.encode).
+        """
+        self._file.write(self.format.encode(boards, shots, first, winner, seed))
+
+    def append_record(self: "ReplayLog", record: bytes) -> None:
+        """
+        Appends a game already encoded by ReplayFormat.encode, for example in another process.
+        """
+        if len(record) != self.format.record_size:
+            raise ValueError("the record does not have the size of the games of this log")
+        self._file.write(record)
+
+    def flush(self: "ReplayLog") -> None:
+        self._file.flush()
+
+    def close(self: "ReplayLog") -> None:
+        self._file.close()
+
+    def __enter__(self: "ReplayLog") -> "ReplayLog":
+        return self
+
+    def __exit__(self: "ReplayLog", *exc) -> None:
+        self.close()
+
+
+class ReplayReader:
+    # Reads a log through a memory map: only the pages of the games that are read are loaded.
+    # It sees the games that were in the log when it was opened.
+
+    def __init__(self: "ReplayReader", path: str) -> None:
+        """
+        Opens a log for reading.
+
+        Parameters:
+        - path (str): The log file.
+
+        Attributes:
+        - format (ReplayFormat): The format of the games of the log.
+        """
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self.format, self._start = ReplayFormat.read_header(self._view)
+        # A record cut short by a writer that crashed is not part of the log
+        self._count = (len(self._map) - self._start) // self.format.record_size
+
+    def __len__(self: "ReplayReader") -> int:
+        return self._count
+
+    def _offset(self: "ReplayReader", i: int) -> int:
+        # Where game i starts in the memory map
+        if not 0 <= i < self._count:
+            raise IndexError("replay index out of range")
+        return self._start + i * self.format.record_size
+
+    def record(self: "ReplayReader", i: int) -> bytes:
+        """
+        Returns the raw record of game i, for example to append it to another log.
+        It is a copy, so it stays valid after the reader is closed.
+        """
+        start = self._offset(i)
+        return bytes(self._view[start:start + self.format.record_size])
+
+    def summary(self: "ReplayReader", i: int) -> tuple[int, int | None, int, int]:
+        """
+        Reads only the header of game i, without decoding the fleets and the shots.
+
+        Returns:
+        - (seed, winner, first, shots): See Replay, shots is the number of shots.
+        """
+        seed, winner, first, count = GAME_HEADER.unpack_from(self._view, self._offset(i))
+        return seed, None if winner == NO_WINNER else winner, first, count
+
+    def __getitem__(self: "ReplayReader", index: "int | slice") -> "Replay | list[Replay]":
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        return self.format.decode(self._view, self._offset(index))
+
+    def __iter__(self: "ReplayReader") -> Iterator["Replay"]:
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self: "ReplayReader") -> None:
+        """
+        Closes the memory map and the file.
+        """
+        try:
+            self._view.release()
+            self._map.close()
+        finally:
+            self._file.close()
+
+    def __enter__(self: "ReplayReader") -> "ReplayReader":
+        return self
+
+    def __exit__(self: "ReplayReader", *exc) -> None:
+        self.close()
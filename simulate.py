@@ -0,0 +1,377 @@
+# Description: This file contains the headless self-play harness.
+# It plays complete games between the AI and an opponent without a terminal, for example:
+#   python simulate.py --games 1000 --workers 8 --opponent hunt
+#   python simulate.py --games 10 --width 30 --height 20 --fleet Destroyer:2,Cruiser:3,Cruiser2:3,Carrier:5
+#   python simulate.py --games 100000 --workers 8 --log games.bsr   (see replays for reading the log)
+import argparse # needed for the command line options
+import json # needed for the machine-readable results
+import math # needed for the percentiles
+import random # needed for the random fleets and opponents
+import time # needed for the solver latencies
+from concurrent.futures import ProcessPoolExecutor # needed for playing games in parallel
+from functools import partial
+# our own modules
+from classes import BitBoard # needed for the boards
+import solver # needed for the AI solver
+import transpositions # needed for sharing solved positions between games
+import replays # needed for recording the games
+
+# The opponents the AI can play against
+# random: fires at a random square
+# hunt: fires around its hits, otherwise at a random square of a checkerboard pattern
+# ai: the same solver as the AI
+OPPONENTS = ("random", "hunt", "ai")
+# The solver modes, see solver.solve_battleship
+MODES = ("auto", "exact", "sample", "sequential")
+
+
+def randomBoard(width: int = 10, height: int = 10, types: dict[str, int] | None = None) -> "BitBoard":
+    """
+    Returns a board with the whole fleet placed at random (uses the random module).
+
+    Args:
+        width, height, types: The size and fleet of the board, see Board.
+    """
+    board = BitBoard(width, height, types)
+    if not board.placeFleetRandom():
+        raise ValueError("the fleet does not fit on the board")
+    return board
+
+
+def parseFleet(text: str) -> dict[str, int]:
+    """
+    Parses a fleet given on the command line, like "Destroyer:2,Cruiser:3".
+
+    Returns:
+        dict: The length of each ship type.
+    """
+    fleet = {}
+    for item in text.split(","):
+        shipType, _, length = item.partition(":")
+        fleet[shipType.strip()] = int(length)
+    return fleet
+
+
+def aiShot(
+    aiSolver: "solver.Solver", cycles: int, budgetMs: float | None = None
+) -> tuple[tuple[int, int], float]:
+    """
+    Picks the square with the highest ship frequency.
+
+    Args:
+        aiSolver: The solver of the board being fired at.
+        cycles: The number of cycles to run the solver.
+        budgetMs: If given, solve within this latency budget instead of a cycle count.
+
+    Returns:
+        tuple: The square, and the time the solver took in seconds.
+    """
+    start = time.perf_counter()
+    if budgetMs is None:
+        square_freq = aiSolver.solve(cycles)
+    else:
+        square_freq, _ = aiSolver.solve_within(budgetMs)
+    latency = time.perf_counter() - start
+    # same choice as the AI in __main__, the first square with the highest frequency
+    max_freq = 0
+    target = None
+    for i, row in enumerate(square_freq):
+        for j, freq in enumerate(row):
+            if freq > max_freq:
+                max_freq = freq
+                target = (i, j)
+    if target is None: # nothing left to learn from the heatmap
+        table = aiSolver.table
+        target = randomShot(aiSolver.miss_mask | aiSolver.hit_mask, random, table.width, table.height)
+    return target, latency
+
+
+def randomShot(shotMask: int, rng: "random.Random", width: int = 10, height: int = 10) -> tuple[int, int]:
+    """
+    Picks a random square that was not guessed yet.
+
+    Args:
+        shotMask: Bitmask of the squares already guessed.
+        rng: The random generator to use.
+        width, height: The size of the board.
+    """
+    cell = rng.choice([cell for cell in range(width * height) if not shotMask >> cell & 1])
+    return divmod(cell, width)
+
+
+def huntShot(board: "BitBoard", rng: "random.Random") -> tuple[int, int]:
+    """
+    Picks a square next to a hit of a ship that is not sunk yet, or else a random
+    square of a checkerboard pattern (every ship covers at least one of them).
+
+    Args:
+        board: The board being fired at.
+        rng: The random generator to use.
+    """
+    width, height = board.width, board.height
+    shotMask = board.misses | board.hits
+    sunkMask = 0
+    for ship in board.ships:
+        if board.isShipSunk(ship):
+            sunkMask |= board.shipMasks[ship]
+
+    targets = []
+    live = board.hits & ~sunkMask
+    while live:
+        low = live & -live
+        r, c = divmod(low.bit_length() - 1, width)
+        live ^= low
+        for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+            if 0 <= nr < height and 0 <= nc < width and not shotMask >> (nr * width + nc) & 1:
+                targets.append((nr, nc))
+    if targets:
+        return rng.choice(targets)
+
+    parity = [
+        cell for cell in range(width * height) if not shotMask >> cell & 1 and sum(divmod(cell, width)) % 2 == 0
+    ]
+    if parity:
+        return divmod(rng.choice(parity), width)
+    return randomShot(shotMask, rng, width, height)
+
+
+def fire(board: "BitBoard", boardSolver: "solver.Solver | None", square: tuple[int, int]) -> None:
+    """
+    Fires at a square and tells the solver of the board (if any) the result and sunk ships.
+    """
+    result = board.hit(square)
+    if boardSolver is None:
+        return
+    boardSolver.observe(square, result)
+    if result.sunk:
+        boardSolver.sink(result.shipType)
+
+
+def playGame(
+    seed: int,
+    opponent: str = "random",
+    cycles: int = 2000,
+    mode: str = "auto",
+    budgetMs: float | None = None,
+    cachePath: str | None = None,
+    width: int = 10,
+    height: int = 10,
+    fleet: dict[str, int] | None = None,
+    record: bool = False,
+    reuse: bool = True,
+) -> dict:
+    """
+    Plays one complete game between the AI (first to fire) and an opponent.
+
+    Args:
+        seed: Seeds the fleets, the solvers and the opponent, so a game can be replayed.
+        opponent: One of OPPONENTS.
+        cycles: The number of cycles the solvers run per turn.
+        mode: The solver mode.
+        budgetMs: If given, the solvers get this latency budget per turn instead of a cycle count.
+        cachePath: If given, the solvers share a transposition cache stored in this file.
+        width, height, fleet: The size and fleet of both boards, the classic game by default.
+        record: Also return the game as a replay record (AI's board first, the AI fires first).
+        reuse: Keep the sampled configurations between turns (see solver.Solver). They are drawn
+            sequentially, so with reuse the "sample" and "sequential" modes play the same.
+
+    Returns:
+        dict: The winner ("ai" or "opponent"), the shots fired by each side and
+        the solver latency of each AI turn in seconds. With record, "replay" is the
+        game encoded by replays.ReplayFormat.encode.
+    """
+    rng = random.Random(seed)
+    random.seed(seed) # Board.placeShipRandom uses the random module
+    aiBoard = randomBoard(width, height, fleet)
+    opponentBoard = randomBoard(width, height, fleet)
+
+    # the AI fires at the opponent's board
+    cache = None if cachePath is None else transpositions.shared_cache(cachePath)
+    aiSolver = solver.Solver(opponentBoard, mode, rng=rng, reuse=reuse, cache=cache)
+    opponentSolver = None
+    if opponent == "ai":
+        opponentSolver = solver.Solver(aiBoard, mode, rng=rng, reuse=reuse, cache=cache)
+
+    shots = [0, 0]
+    history = []
+    latencies = []
+    while True:
+        # AI's turn
+        square, latency = aiShot(aiSolver, cycles, budgetMs)
+        latencies.append(latency)
+        history.append(square)
+        fire(opponentBoard, aiSolver, square)
+        shots[0] += 1
+        if opponentBoard.gameOver():
+            winner = "ai"
+            break
+
+        # opponent's turn
+        if opponent == "ai":
+            square, _ = aiShot(opponentSolver, cycles, budgetMs)
+        elif opponent == "hunt":
+            square = huntShot(aiBoard, rng)
+        else:
+            square = randomShot(aiBoard.misses | aiBoard.hits, rng, width, height)
+        history.append(square)
+        fire(aiBoard, opponentSolver, square)
+        shots[1] += 1
+        if aiBoard.gameOver():
+            winner = "opponent"
+            break
+
+    result = {
+        "seed": seed,
+        "winner": winner,
+        "aiShots": shots[0],
+        "opponentShots": shots[1],
+        "latencies": latencies,
+    }
+    if record:
+        replayFormat = replays.ReplayFormat(width, height, fleet)
+        result["replay"] = replayFormat.encode(
+            [aiBoard, opponentBoard], history, winner=0 if winner == "ai" else 1, seed=seed
+        )
+    return result
+
+
+def simulate(
+    games: int,
+    opponent: str = "random",
+    cycles: int = 2000,
+    mode: str = "auto",
+    workers: int = 1,
+    seed: int = 0,
+    budgetMs: float | None = None,
+    cachePath: str | None = None,
+    width: int = 10,
+    height: int = 10,
+    fleet: dict[str, int] | None = None,
+    logPath: str | None = None,
+    reuse: bool = True,
+) -> list[dict]:
+    """
+    Plays many games, spread over a process pool.
+
+    Args:
+        games: The number of games to play.
+        opponent, cycles, mode, budgetMs, cachePath, width, height, fleet, reuse: See playGame.
+        workers: The number of processes. 1 plays every game in this process.
+        seed: Game i is played with seed + i.
+        logPath: If given, every game is appended to this replay log (see replays), in order.
+
+    Returns:
+        list: The result of every game, in order.
+    """
+    seeds = range(seed, seed + games)
+    play = partial(
+        playGame, opponent=opponent, cycles=cycles, mode=mode, budgetMs=budgetMs, cachePath=cachePath,
+        width=width, height=height, fleet=fleet, record=logPath is not None, reuse=reuse,
+    )
+    if workers <= 1:
+        results = [play(s) for s in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(play, seeds, chunksize=max(1, games // (workers * 8))))
+    if logPath is not None:
+        # the workers encode their games, only this process writes to the log
+        with replays.ReplayLog(logPath, width, height, fleet) as log:
+            for result in results:
+                log.append_record(result.pop("replay"))
+    return results
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Returns the q-th percentile (0-100) of the values, using the nearest rank.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(results: list[dict]) -> dict:
+    """
+    Summarizes game results: win rate, shots-to-win distribution and solver latency percentiles.
+
+    Args:
+        results: The results returned by simulate.
+
+    Returns:
+        dict: The summary (latencies in milliseconds).
+    """
+    aiWins = [r["aiShots"] for r in results if r["winner"] == "ai"]
+    opponentWins = [r["opponentShots"] for r in results if r["winner"] == "opponent"]
+    latencies = [l * 1000 for r in results for l in r["latencies"]]
+    distribution = {}
+    for shots in aiWins:
+        distribution[shots] = distribution.get(shots, 0) + 1
+    return {
+        "games": len(results),
+        "aiWinRate": len(aiWins) / len(results) if results else 0.0,
+        "aiShotsToWin": {
+            "mean": sum(aiWins) / len(aiWins) if aiWins else 0.0,
+            **{f"p{q}": percentile(aiWins, q) for q in (10, 50, 90)},
+            "histogram": dict(sorted(distribution.items())),
+        },
+        "opponentShotsToWin": {
+            "mean": sum(opponentWins) / len(opponentWins) if opponentWins else 0.0,
+            **{f"p{q}": percentile(opponentWins, q) for q in (10, 50, 90)},
+        },
+        "latencyMs": {f"p{q}": percentile(latencies, q) for q in (50, 90, 99, 100)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play headless games between the AI and an opponent.")
+    parser.add_argument("--games", type=int, default=100, help="number of games to play")
+    parser.add_argument("--opponent", choices=OPPONENTS, default="random", help="who the AI plays against")
+    parser.add_argument("--cycles", type=int, default=2000, help="solver cycles per turn")
+    parser.add_argument("--mode", choices=MODES, default="auto", help="solver mode")
+    parser.add_argument(
+        "--reuse",
+        action=argparse.BooleanOptionalAction,
+        help="keep the sampled configurations between turns (default: only in the auto and exact modes,"
+        " so the sampling modes are measured as they are)",
+    )
+    parser.add_argument("--budget-ms", type=float, help="solver latency budget per turn, instead of --cycles")
+    parser.add_argument("--cache", help="share solved positions between games (and runs) in this SQLite file")
+    parser.add_argument("--width", type=int, default=10, help="number of columns of the boards")
+    parser.add_argument("--height", type=int, default=10, help="number of rows of the boards")
+    parser.add_argument(
+        "--fleet", type=parseFleet, help="ship types and lengths, like Destroyer:2,Cruiser:3 (default: the classic fleet)"
+    )
+    parser.add_argument("--log", help="append every game to this replay log")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--json", help="also write the summary and every game to this file")
+    args = parser.parse_args()
+    if args.reuse is None:
+        args.reuse = args.mode in ("auto", "exact")
+
+    start = time.perf_counter()
+    results = simulate(
+        args.games, args.opponent, args.cycles, args.mode, args.workers, args.seed, args.budget_ms, args.cache,
+        args.width, args.height, args.fleet, args.log, args.reuse,
+    )
+    elapsed = time.perf_counter() - start
+    summary = summarize(results)
+
+    shots = summary["aiShotsToWin"]
+    latency = summary["latencyMs"]
+    print(f"{summary['games']} games against '{args.opponent}' in {elapsed:.1f}s")
+    print(f"AI win rate: {summary['aiWinRate']:.1%}")
+    print(f"AI shots to win: mean {shots['mean']:.1f}, p10 {shots['p10']}, p50 {shots['p50']}, p90 {shots['p90']}")
+    print(
+        f"Solver latency (ms): p50 {latency['p50']:.1f}, p90 {latency['p90']:.1f}, "
+        f"p99 {latency['p99']:.1f}, max {latency['p100']:.1f}"
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"summary": summary, "games": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,139 +1,1284 @@
 from classes import Board
+from placements import PlacementTable, placement_table
+from transpositions import TranspositionCache, from_canonical, symmetrize, to_canonical, zobrist_keys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import Callable, Iterator
+import math
 import random
+import time
+import tracemalloc
 
+# NumPy is optional, it is only needed for the "numpy" backend
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def solve_battleship(board: "Board", cycles: int = 1000) -> list[list[float]]:
+# In "auto" mode, positions with at most this many possible fleet configurations
+# (product of the possible locations of every ship) are counted exactly.
+EXACT_THRESHOLD = 20_000_000
+# The exact solver gives up if it has to keep track of more partial fleets than this.
+EXACT_MAX_STATES = 200_000
+# Number of configurations the NumPy backend draws at once
+NUMPY_BATCH = 65_536
+# Time-budgeted solves draw batches of samples, doubling from the first to the max size
+# (or fewer, if the time left is too short for them)
+BUDGET_FIRST_BATCH = 64
+BUDGET_MAX_BATCH = 4096
+# They stop early once the best square is ahead by this many standard errors (about 95%)...
+CONFIDENCE_Z = 1.96
+# ... or once the best squares are known to within this frequency
+STABLE_TOLERANCE = 0.01
+# but never with fewer (effective) samples than this
+BUDGET_MIN_SAMPLES = 200
+# With reuse, each kept sample gets this many Metropolis moves per ship after a shot,
+# so the copies made by resampling drift apart again
+REJUVENATE_MOVES = 2
+# An exact count within a budget gets at most this share of it, the rest is left for sampling if it fails
+EXACT_BUDGET_SHARE = 0.5
+
+
+def solve_battleship(
+    board: "Board",
+    cycles: int = 1000,
+    mode: str = "sample",
+    backend: str = "auto",
+    seed: int | None = None,
+    rng: "random.Random | None" = None,
+    workers: int = 1,
+    sunk: "list[str] | dict[str, list[tuple[int, int]]] | None" = None,
+    stats: "SolveStats | None" = None,
+    cache: "TranspositionCache | None" = None,
+) -> list[list[float]]:
     """
     Solve the battleship game by generating a frequency map of possible ship locations on the board.
     Parameters:
     - board (Board): The battleship board object.
     - cycles (int): The number of cycles to run the solver. Default is 1000.
+    - mode (str): "sample" for Monte Carlo sampling, "sequential" for sampling without rejections
+      that places ships on the hits first, "exact" to count every fleet configuration, "auto" to
+      count exactly once the position is small enough and sample sequentially before. Default is "sample".
+    - backend (str): "python" or "numpy" for the "sample" mode. "auto" uses NumPy if it is installed.
+    - seed (int): Seed for a new random generator, to get reproducible results.
+    - rng (random.Random): The random generator to use. Default is the global one of the random module.
+    - workers (int): Split the cycles across this many processes. Default is 1 (no processes).
+    - sunk (list or dict): The types of the ships already sunk, or a dict from the type of each
+      sunk ship to the squares it covered.
+    - stats (SolveStats): If given, filled with the timings and counters of this solve.
+    - cache (TranspositionCache): If given, board states solved before are answered from it,
+      and this one is stored in it.
     Returns:
     - square_freq (list): A 2D list representing the frequency of ship locations on each square of the board.
     """
 
-    # Create a dictionary to store all possible ship locations
-    possible_loc = {}
+    if stats is None:
+        return Solver(board, mode, backend, seed, rng, workers, sunk=sunk, cache=cache).solve(cycles)
+
+    stats.start()
+    start = time.perf_counter()
+    state = Solver(board, mode, backend, seed, rng, workers, sunk=sunk, cache=cache)
+    stats.phases["setup"] = time.perf_counter() - start
+    return state.solve(cycles, stats)
+
+
+def solve_within(
+    board: "Board",
+    budget_ms: float,
+    mode: str = "auto",
+    backend: str = "auto",
+    seed: int | None = None,
+    rng: "random.Random | None" = None,
+    workers: int = 1,
+    sunk: "list[str] | dict[str, list[tuple[int, int]]] | None" = None,
+    stats: "SolveStats | None" = None,
+    on_progress: "Callable[[float, int], None] | None" = None,
+    cache: "TranspositionCache | None" = None,
+) -> tuple[list[list[float]], int]:
+    """
+    Solve the battleship game within a latency budget (see Solver.solve_within).
+    Parameters:
+    - board (Board): The battleship board object.
+    - budget_ms (float): The latency budget in milliseconds.
+    - mode, backend, seed, rng, workers, sunk, stats, cache: Same as for solve_battleship. The default mode is "auto".
+    - on_progress (callable): See Solver.solve_within.
+    Returns:
+    - (square_freq, samples): The frequency map and the number of samples it is based on.
+    """
+    solver = Solver(board, mode, backend, seed, rng, workers, sunk=sunk, cache=cache)
+    return solver.solve_within(budget_ms, stats, on_progress)
+
+
+class SolveStats:
+    # Timings and counters of one solve, to find out why a solve is slow.
+    # Pass one to solve_battleship or Solver.solve, or set Solver.on_stats to get one per solve.
+
+    def __init__(self: "SolveStats", memory: bool = False) -> None:
+        """
+        Creates empty stats.
+        Parameters:
+        - memory (bool): Also record the peak memory (uses tracemalloc, which slows everything down).
+
+        Attributes:
+        - phases (dict): Wall time of each phase in seconds (setup, estimate, exact, sampling, aggregation).
+        - mode (str): The mode that produced the heatmap ("exact", "sample", "sequential", "reuse"
+          or "cached").
+        - placements (dict): The number of candidate placements of each ship type.
+        - conflicts (int | None): The number of overlapping pairs of placements of different ships.
+          None on tables with a lazy index (see PlacementTable), where counting them would build
+          the conflicts of every placement and take far longer than the solve.
+        - estimate (int): The configuration estimate used by the "auto" mode.
+        - cycles (int): The number of samples drawn (0 for an exact count).
+        - accepted (float): The number of valid configurations: samples that were not rejected (or
+          did not hit a dead end), configurations counted, or distinct kept samples (reuse).
+        - ess (float | None): The effective sample size of sequential sampling (and reuse).
+        - peak_memory (int | None): The peak memory of the solve in bytes, if recorded.
+        """
+        self.memory = memory
+        self.phases: dict[str, float] = {}
+        self.mode = ""
+        self.placements: dict[str, int] = {}
+        self.conflicts: int | None = 0
+        self.estimate = 0
+        self.cycles = 0
+        self.accepted: float = 0
+        self.ess: float | None = None
+        self.peak_memory: int | None = None
+        self._tracing = False
+
+    def start(self: "SolveStats") -> None:
+        """
+        Starts recording the peak memory, if asked to.
+        """
+        if self.memory and not self._tracing:
+            self._tracing = not tracemalloc.is_tracing()
+            if self._tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    def stop(self: "SolveStats") -> None:
+        """
+        Stops recording the peak memory.
+        """
+        if self.memory and tracemalloc.is_tracing():
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+    def lap(self: "SolveStats", phase: str, clock: float) -> float:
+        """
+        Adds the time since clock to a phase.
+        Parameters:
+        - phase (str): The name of the phase.
+        - clock (float): The time.perf_counter() the phase started at.
+        Returns:
+        - float: The current time.perf_counter(), where the next phase starts.
+        """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - clock
+        return now
+
+    @property
+    def acceptance(self: "SolveStats") -> float:
+        """
+        The share of the drawn samples that were accepted (valid_cnt / cycles).
+        """
+        return self.accepted / self.cycles if self.cycles else 1.0
+
+    def __str__(self: "SolveStats") -> str:
+        phases = ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.phases.items())
+        text = f"{self.mode}: {phases}; placements {sum(self.placements.values())}"
+        if self.conflicts is not None:
+            text += f", conflicts {self.conflicts}"
+        if self.cycles:
+            text += f"; {self.accepted:.0f}/{self.cycles} accepted"
+        if self.ess is not None:
+            text += f", ess {self.ess:.0f}"
+        if self.peak_memory is not None:
+            text += f"; peak memory {self.peak_memory / 1024:.0f}KiB"
+        return text
+
+
+class Solver:
+    # Solver state tied to one board. It keeps the possible locations of every ship between
+    # shots, so each shot only costs the work of removing the locations it rules out.
 
-    # For each ship from 1 to x
-    for ship_type in Board.types:
-        possible_loc[ship_type] = []
-        ship_length = Board.types[ship_type]
+    def __init__(
+        self: "Solver",
+        board: "Board",
+        mode: str = "auto",
+        backend: str = "auto",
+        seed: int | None = None,
+        rng: "random.Random | None" = None,
+        workers: int = 1,
+        reuse: bool = False,
+        sunk: "list[str] | dict[str, list[tuple[int, int]]] | None" = None,
+        on_stats: "Callable[[SolveStats], None] | None" = None,
+        cache: "TranspositionCache | None" = None,
+    ) -> None:
+        """
+        Reads the current state of a board.
+        Parameters:
+        - board (Board): The battleship board object.
+        - mode, backend, seed, rng, workers: Same as for solve_battleship. The default mode is "auto".
+        - reuse (bool): Keep the sampled configurations between shots (a particle filter).
+          Samples are drawn sequentially in this process, whatever the mode, backend and workers.
+        - sunk (list or dict): The ships already sunk, see sink.
+        - on_stats (callable): If given, called with the SolveStats of every solve.
+        - cache (TranspositionCache): If given, board states solved before are answered from it,
+          and every new one is stored in it.
 
-        # For each square from 1 to 100
-        for x in range(10):
-            for y in range(10):
+        Attributes:
+        - table (PlacementTable): The placement table of the board.
+        - miss_mask, hit_mask (int): Bitmasks of the missed and hit squares.
+        - sunk_mask (int): Bitmask of the squares of the sunk ships whose squares are known.
+        - possible_loc (dict): The possible placement ids of each ship type (in no particular order).
+        - particles (list): With reuse, the kept (occupied mask, placement ids) samples, the ids in
+          the order of possible_loc. They are equally likely configurations of the current board.
+        - sunk (set): The types of the sunk ships.
+        - symmetric_keys (list): The Zobrist hash of the current state (shots and sunk ships) turned
+          by each symmetry of the board, see transpositions.ZobristKeys.keys.
+        """
+        self.board = board
+        self.mode = mode
+        self.backend = backend
+        self.workers = workers
+        self.reuse = reuse
+        self.on_stats = on_stats
+        self.cache = cache
+        self.particles: list[tuple[int, tuple[int, ...]]] = []
+        # The kept samples were filtered by a shot since they were last moved
+        self._filtered = False
+        if rng is None:
+            rng = random if seed is None else random.Random(seed)
+        self.rng = rng
 
-                # For each orientation from vertical to horizontal
-                for orientation in ["horizontal", "vertical"]:
-                    pos = []
-                    if orientation == "horizontal":
-                        if x + ship_length > 10:
-                            continue
-                        pos = [(x + i, y) for i in range(ship_length)]
-                    else:
-                        if y + ship_length > 10:
-                            continue
-                        pos = [(x, y + i) for i in range(ship_length)]
+        # All placements of every ship type, built once and shared between calls
+        fleet = board.fleet()
+        self.table = placement_table(board.width, board.height, fleet)
 
-                    # If the ship would overhang the board, continue
-                    if any(s[0] >= 10 or s[1] >= 10 for s in pos):
-                        continue
+        # Remove the ship locations that would overlap a "miss" square
+        self.miss_mask, self.hit_mask = board_masks(board)
+        self.sunk_mask = 0
+        self.sunk: set[str] = set()
+        self.keys = zobrist_keys(board.width, board.height, fleet)
+        self.symmetric_keys = self.keys.keys(self.miss_mask, self.hit_mask)
+        self.possible_loc = self.table.live(self.miss_mask)
+        # Where each placement id is in its possible_loc list, for O(1) removal
+        self._position = {
+            ship_type: {pid: i for i, pid in enumerate(locations)}
+            for ship_type, locations in self.possible_loc.items()
+        }
 
-                    # If the ship would overlap a "miss" square, continue
-                    if any(board.grid[s[0]][s[1]] == 1 for s in pos):
-                        continue
+        if isinstance(sunk, dict):
+            for ship_type, squares in sunk.items():
+                self.sink(ship_type, squares)
+        elif sunk:
+            for ship_type in sunk:
+                self.sink(ship_type)
 
-                    # Add this ship location to the list of possible locations
-                    possible_loc[ship_type].append(pos)
+    def observe(self: "Solver", square: tuple[int, int], result: bool) -> None:
+        """
+        Updates the solver after a shot on its board.
+        Parameters:
+        - square (tuple): The coordinates of the square that was guessed.
+        - result (bool): The result of Board.hit, True for a hit.
+        """
+        cell = square[0] * self.table.width + square[1]
+        bit = 1 << cell
+        # A square fired at again changes nothing (and would flip its key back out of the hash)
+        if (self.miss_mask | self.hit_mask) & bit:
+            return
+        images = self.keys.hit_images[cell] if result else self.keys.miss_images[cell]
+        self.symmetric_keys = [key ^ image for key, image in zip(self.symmetric_keys, images)]
+        # Drop the kept samples that contradict the shot. The survivors are still equally
+        # likely configurations, now of the board after the shot.
+        if self.particles:
+            self.particles = [p for p in self.particles if bool(p[0] & bit) == bool(result)]
+            self._filtered = True
 
-    # Create a list to store all incompatible ship locations
-    incompatible_loc = []
+        if result:
+            self.hit_mask |= bit
+            return
 
-    # For each ship
-    for ship_type in possible_loc:
+        self.miss_mask |= bit
+        self._drop(cell)
 
-        # For each possible ship location
-        for pos in possible_loc[ship_type]:
+    def sink(self: "Solver", ship_type: str, squares: list[tuple[int, int]] | None = None) -> None:
+        """
+        Updates the solver after a ship of its board was sunk.
+        If the squares are known, the ship is taken out of the search and its squares are kept
+        out of the other ships' way. Otherwise it can only lie on hit squares, so its locations
+        are narrowed down to those.
+        Parameters:
+        - ship_type (str): The type of the sunk ship.
+        - squares (list): The squares the ship covered, if known.
+        """
+        if ship_type not in self.possible_loc:
+            return
+        if ship_type not in self.sunk:
+            self.sunk.add(ship_type)
+            self.symmetric_keys = [key ^ self.keys.sunk[ship_type] for key in self.symmetric_keys]
+        # Kept samples do not know which ship is which, start over
+        self.particles = []
 
-            # For every other ship
-            for other_ship_type in possible_loc:
-                if ship_type == other_ship_type:
+        if squares is None:
+            locations = [
+                pid for pid in self.possible_loc[ship_type]
+                if not self.table.masks[pid] & ~self.hit_mask
+            ]
+            self.possible_loc[ship_type] = locations
+            self._position[ship_type] = {pid: i for i, pid in enumerate(locations)}
+            return
+
+        del self.possible_loc[ship_type]
+        del self._position[ship_type]
+        for s in squares:
+            cell = s[0] * self.table.width + s[1]
+            self.sunk_mask |= 1 << cell
+            images = self.keys.sunk_cell_images[cell]
+            self.symmetric_keys = [key ^ image for key, image in zip(self.symmetric_keys, images)]
+            self._drop(cell)
+
+    @property
+    def key(self: "Solver") -> int:
+        """
+        The canonical Zobrist hash of the current state: the same for all orientations of it.
+        """
+        return min(self.symmetric_keys)
+
+    @property
+    def stabilizer(self: "Solver") -> list[tuple[int, ...]]:
+        """
+        The symmetries that map the current state onto itself (always at least the identity).
+        """
+        identity = self.symmetric_keys[0]
+        return [image for image, key in zip(self.keys.maps, self.symmetric_keys) if key == identity]
+
+    def _symmetrize(self: "Solver", square_freq: list[list[float]]) -> list[list[float]]:
+        # Averages a sampled map over the symmetries of the state, if it has any
+        stabilizer = self.stabilizer
+        if len(stabilizer) == 1:
+            return square_freq
+        return symmetrize(square_freq, stabilizer)
+
+    def _cache_get(self: "Solver") -> tuple[list[list[float]], int, bool] | None:
+        # Looks the state up in its canonical orientation and turns the map back
+        key = self.key
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        image = self.keys.maps[self.symmetric_keys.index(key)]
+        return from_canonical(entry[0], image), entry[1], entry[2]
+
+    def _cache_put(self: "Solver", square_freq: list[list[float]], valid: int, exact: bool) -> None:
+        # Stores the map in the canonical orientation of the state
+        key = self.key
+        image = self.keys.maps[self.symmetric_keys.index(key)]
+        self.cache.put(key, to_canonical(square_freq, image), valid, exact)
+
+    def _drop(self: "Solver", cell: int) -> None:
+        # Drop only the locations covering the square
+        for ship_type, locations in self.possible_loc.items():
+            ids = self.table.ids[ship_type]
+            position = self._position[ship_type]
+            for pid in self.table.cell_ids[cell]:
+                if pid not in ids or pid not in position:
                     continue
+                # Move the last location into the removed one's place
+                i = position.pop(pid)
+                last = locations.pop()
+                if last != pid:
+                    locations[i] = last
+                    position[last] = i
+
+    def solve(self: "Solver", cycles: int = 1000, stats: "SolveStats | None" = None) -> list[list[float]]:
+        """
+        Generates the frequency map of possible ship locations for the current state.
+        Parameters:
+        - cycles (int): The number of cycles to run the solver. Default is 1000.
+        - stats (SolveStats): If given, filled with the timings and counters of this solve.
+        Returns:
+        - square_freq (list): A 2D list representing the frequency of ship locations on each square of the board.
+        """
+        if stats is None and self.on_stats is not None:
+            stats = SolveStats()
+        if stats is None:
+            return self._solve(cycles, None)
+
+        stats.start()
+        stats.placements = {ship_type: len(locations) for ship_type, locations in self.possible_loc.items()}
+        stats.conflicts = None if self.table.lazy else count_conflicts(self.table, self.possible_loc)
+        square_freq = self._solve(cycles, stats)
+        stats.stop()
+        if self.on_stats is not None:
+            self.on_stats(stats)
+        return square_freq
+
+    def _solve(self: "Solver", cycles: int, stats: "SolveStats | None") -> list[list[float]]:
+        if self.cache is not None:
+            entry = self._cache_get()
+            # An exact count is always good enough, a sampled map only if it has enough samples
+            if entry is not None and (entry[2] or entry[1] >= cycles):
+                if stats is not None:
+                    stats.mode = "cached"
+                return entry[0]
+        square_freq, valid, exact = self._compute(cycles, stats)
+        if self.cache is not None:
+            self._cache_put(square_freq, valid, exact)
+        return square_freq
+
+    def _compute(
+        self: "Solver", cycles: int, stats: "SolveStats | None"
+    ) -> tuple[list[list[float]], int, bool]:
+        # Returns the frequency map, the number of valid configurations it was built from
+        # (counted, accepted samples or distinct kept samples) and if it is exact
+        table = self.table
+        mode = self.mode
+        shot_mask = self.miss_mask | self.hit_mask
+        # The squares of sunk ships are already explained
+        hit_mask = self.hit_mask & ~self.sunk_mask
+        if stats is not None:
+            clock = time.perf_counter()
 
-                # For every possible other-ship location
-                for other_ship_squares in possible_loc[other_ship_type]:
+        if mode == "auto":
+            estimate = estimate_configurations(self.possible_loc)
+            mode = "exact" if estimate <= EXACT_THRESHOLD else "sequential"
+            if stats is not None:
+                stats.estimate = estimate
+                clock = stats.lap("estimate", clock)
+
+        if mode == "exact":
+            counted = count_configurations(table, self.possible_loc, hit_mask)
+            if stats is not None:
+                clock = stats.lap("exact", clock)
+            if counted is not None:
+                if stats is not None:
+                    stats.mode = "exact"
+                    stats.accepted = counted[1]
+                square_freq = square_frequencies(table, *counted, shot_mask)
+                if stats is not None:
+                    stats.lap("aggregation", clock)
+                return square_freq, counted[1], True
+            # Too many configurations to count, sample instead
+            mode = "sequential"
+
+        if self.reuse:
+            location_freq, valid_cnt, square_weight = self.resample(cycles)
+            accepted = round(valid_cnt * valid_cnt / square_weight) if square_weight else 0
+            mode = "reuse"
+        else:
+            location_freq, valid_cnt, square_weight, accepted = self._sample(mode, hit_mask, cycles)
+        if stats is not None:
+            stats.mode = mode
+            stats.cycles = cycles
+            stats.accepted = accepted
+            if mode in ("sequential", "reuse"):
+                stats.ess = valid_cnt * valid_cnt / square_weight if square_weight else 0.0
+            clock = stats.lap("sampling", clock)
+
+        square_freq = self._symmetrize(square_frequencies(table, location_freq, valid_cnt, shot_mask))
+        if stats is not None:
+            stats.lap("aggregation", clock)
+        return square_freq, accepted, False
+
+    def _sample(
+        self: "Solver", mode: str, hit_mask: int, cycles: int
+    ) -> tuple[list[float], float, float, int]:
+        # Runs the sampler of a mode, in this process or across the pool
+        if self.workers > 1:
+            return sample_parallel(
+                self.table, self.possible_loc, hit_mask, cycles, mode, self.backend, self.rng, self.workers
+            )
+        return sample(self.table, self.possible_loc, hit_mask, cycles, mode, self.backend, self.rng)
+
+    def solve_within(
+        self: "Solver",
+        budget_ms: float,
+        stats: "SolveStats | None" = None,
+        on_progress: "Callable[[float, int], None] | None" = None,
+    ) -> tuple[list[list[float]], int]:
+        """
+        Generates the frequency map within a latency budget instead of a fixed cycle count.
+        A single draw is timed first, then samples are drawn in growing batches, each sized to fit
+        the time left, until the budget runs out or the best square is statistically settled: its
+        frequency is ahead of the runner-up by more than CONFIDENCE_Z standard errors, or both are
+        known to within STABLE_TOLERANCE.
+        An exact count gets EXACT_BUDGET_SHARE of the budget. If it does not finish by then, it
+        falls back to sampling, which then draws at least BUDGET_MIN_SAMPLES samples even if that
+        takes longer than the budget. At least one batch is always drawn, unless the state is in
+        the cache, counted exactly or from at least BUDGET_MIN_SAMPLES valid configurations.
+        Parameters:
+        - budget_ms (float): The latency budget in milliseconds.
+        - stats (SolveStats): If given, filled with the timings and counters of this solve.
+        - on_progress (callable): If given, called after every batch with the share of the budget
+          used so far (0 to 1) and the number of samples drawn, e.g. to show a progress bar.
+        Returns:
+        - (square_freq, samples): The best frequency map so far and the number of samples drawn
+          (for an exact count, the number of configurations counted; for a cached map, the number
+          of valid configurations it was built from).
+        """
+        if stats is None and self.on_stats is not None:
+            stats = SolveStats()
+        if stats is not None:
+            stats.start()
+            clock = time.perf_counter()
+        deadline = time.perf_counter() + budget_ms / 1000
+        table = self.table
+        mode = self.mode
+        shot_mask = self.miss_mask | self.hit_mask
+        # The squares of sunk ships are already explained
+        hit_mask = self.hit_mask & ~self.sunk_mask
+
+        result = None
+        exact = False
+        if self.cache is not None:
+            entry = self._cache_get()
+            # A map from a few samples would be worse than what the budget can draw
+            if entry is not None and (entry[2] or entry[1] >= BUDGET_MIN_SAMPLES):
+                result = entry[0], entry[1]
+                if stats is not None:
+                    stats.mode = "cached"
+        cached = result is not None
+
+        if result is None and mode == "auto":
+            mode = "exact" if estimate_configurations(self.possible_loc) <= EXACT_THRESHOLD else "sequential"
+
+        # Samples drawn even past the deadline: only a failed exact count leaves too little time for a useful map
+        minimum = 1
+        if result is None and mode == "exact":
+            counted = count_configurations(
+                table, self.possible_loc, hit_mask, deadline=deadline - (1 - EXACT_BUDGET_SHARE) * budget_ms / 1000
+            )
+            if stats is not None:
+                clock = stats.lap("exact", clock)
+            if counted is not None:
+                result = square_frequencies(table, *counted, shot_mask), counted[1]
+                valid = counted[1]
+                exact = True
+                if stats is not None:
+                    stats.mode = "exact"
+                    stats.accepted = counted[1]
+            else:
+                # Too many configurations to count in time, sample instead
+                mode = "sequential"
+                minimum = BUDGET_MIN_SAMPLES
+
+        if result is None:
+            location_freq = [0.0] * len(table.masks)
+            valid_cnt = 0.0
+            square_weight = 0.0
+            accepted = 0
+            samples = 0
+            # A single draw first, to learn how many fit in the budget (they can take milliseconds on large boards)
+            batch = 1
+            overhead = None
+            while True:
+                started = time.perf_counter()
+                if self.reuse:
+                    location_freq, valid_cnt, square_weight = self.resample(len(self.particles) + batch, deadline)
+                    accepted = round(valid_cnt * valid_cnt / square_weight) if square_weight else 0
+                else:
+                    batch_freq, batch_cnt, batch_square, batch_accepted = self._sample(mode, hit_mask, batch)
+                    for pid, count in enumerate(batch_freq):
+                        location_freq[pid] += count
+                    valid_cnt += batch_cnt
+                    square_weight += batch_square
+                    accepted += batch_accepted
+                samples += batch
+                square_freq = self._symmetrize(square_frequencies(table, location_freq, valid_cnt, shot_mask))
+                if on_progress is not None:
+                    on_progress(min(1.0, 1 - (deadline - time.perf_counter()) * 1000 / budget_ms), samples)
+                if square_weight and is_settled(square_freq, valid_cnt * valid_cnt / square_weight):
+                    break
+                # Grow the batches, but not past what the time left allows. A batch costs a fixed
+                # overhead (at most the fastest batch so far) plus its draws (at most the last
+                # batch's time per sample). The probe includes both, so it alone bounds a first batch
+                now = time.perf_counter()
+                elapsed = now - started
+                if overhead is None:
+                    fits = (deadline - now) / elapsed
+                    grown = BUDGET_FIRST_BATCH
+                    overhead = elapsed
+                else:
+                    overhead = min(overhead, elapsed)
+                    fits = (deadline - now - overhead) / (elapsed / batch)
+                    grown = 2 * batch
+                batch = min(grown, BUDGET_MAX_BATCH, int(fits)) if now < deadline else 0
+                if batch < 1:
+                    if samples >= minimum:
+                        break
+                    batch = minimum - samples
+            result = square_freq, samples
+            valid = accepted
+            if stats is not None:
+                stats.mode = "reuse" if self.reuse else mode
+                stats.cycles = samples
+                stats.accepted = accepted
+                stats.ess = valid_cnt * valid_cnt / square_weight if square_weight else 0.0
+                stats.lap("sampling", clock)
 
-                    # If the two ships would overlap, save to list of incompatible locations
-                    if any(s in other_ship_squares for s in pos):
-                        incompatible_loc.append((pos, other_ship_squares))
+        if self.cache is not None and not cached:
+            # The map is worth the valid configurations it was built from, not the draws
+            self._cache_put(result[0], valid, exact)
+        if stats is not None:
+            stats.placements = {ship_type: len(locations) for ship_type, locations in self.possible_loc.items()}
+            stats.conflicts = None if table.lazy else count_conflicts(table, self.possible_loc)
+            stats.stop()
+            if self.on_stats is not None:
+                self.on_stats(stats)
+        return result
 
-    location_freq = {
-        ship_type: [0] * len(possible_loc[ship_type]) for ship_type in Board.types
-    }
+    def resample(self: "Solver", cycles: int, deadline: float | None = None) -> tuple[list[float], float, float]:
+        """
+        Tops the kept samples up to the cycle count with fresh sequential draws.
+        The fresh draws have importance weights, so they are resampled in proportion to their
+        weights (systematic resampling) into equally weighted samples before being kept.
+        That copies the heavy draws, and shots only ever remove samples, so after a shot the kept
+        samples are first moved apart (see rejuvenate).
+        Parameters:
+        - cycles (int): The number of samples to keep.
+        - deadline (float): Stop moving samples apart if time.perf_counter() passes this.
+        Returns:
+        - (location_freq, valid_cnt, square_weight): The count of each placement id, the number of
+          samples and, as for sample, the square weight: the effective sample size it gives is the
+          number of distinct configurations among the samples.
+        """
+        if self._filtered:
+            self.rejuvenate(deadline=deadline)
+            self._filtered = False
+        missing = cycles - len(self.particles)
+        if missing > 0:
+            hit_mask = self.hit_mask & ~self.sunk_mask
+            draws = list(draw_sequential(self.table, self.possible_loc, missing, hit_mask, self.rng))
+            total_weight = sum(draw[0] for draw in draws)
+            if draws:
+                # One pointer every step along the cumulative weights, starting at a random offset
+                step = total_weight / missing
+                pointer = self.rng.random() * step
+                cumulative = 0.0
+                for weight, occupied, selected in draws:
+                    cumulative += weight
+                    while pointer < cumulative and len(self.particles) < cycles:
+                        self.particles.append((occupied, selected))
+                        pointer += step
+
+        location_freq = [0] * len(self.table.masks)
+        for _, selected in self.particles:
+            for pid in selected:
+                location_freq[pid] += 1
+        count = len(self.particles)
+        distinct = len({occupied for occupied, _ in self.particles})
+        return location_freq, count, count * count / distinct if distinct else 0.0
+
+    def rejuvenate(self: "Solver", moves: int = REJUVENATE_MOVES, deadline: float | None = None) -> None:
+        """
+        Moves the kept samples apart with Metropolis steps: a random ship of a sample jumps to a
+        random one of its possible locations, if it overlaps no other ship and every hit is still
+        covered. The proposals are symmetric and every valid configuration is equally likely, so
+        the samples stay equally likely configurations, but the copies no longer stay identical.
+        Parameters:
+        - moves (int): The number of steps per sample and ship.
+        - deadline (float): Leave the remaining samples as they are if time.perf_counter() passes this.
+        """
+        masks = self.table.masks
+        rng = self.rng
+        hit_mask = self.hit_mask & ~self.sunk_mask
+        locations = list(self.possible_loc.values())
+        steps = moves * len(locations)
+        for i, (occupied, selected) in enumerate(self.particles):
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            selected = list(selected)
+            for _ in range(steps):
+                k = rng.randrange(len(locations))
+                pid = locations[k][rng.randrange(len(locations[k]))]
+                others = occupied & ~masks[selected[k]]
+                if others & masks[pid] or hit_mask & ~(others | masks[pid]):
+                    continue
+                occupied = others | masks[pid]
+                selected[k] = pid
+            self.particles[i] = (occupied, tuple(selected))
+
+
+def sample(
+    table: "PlacementTable",
+    possible_loc: dict[str, list[int]],
+    hit_mask: int,
+    cycles: int,
+    mode: str,
+    backend: str,
+    rng: "random.Random",
+) -> tuple[list[float], float, float, int]:
+    """
+    Runs the sampler of a solver mode.
+    Parameters:
+    - table (PlacementTable): The placement table.
+    - possible_loc (dict): The possible placement ids of each ship type.
+    - hit_mask (int): Bitmask of the hit squares. Configurations must cover all of them.
+    - cycles (int): The number of configurations to draw.
+    - mode (str): "sample" or "sequential".
+    - backend (str): "python", "numpy" or "auto" for the "sample" mode.
+    - rng (random.Random): The random generator to use.
+    Returns:
+    - (location_freq, valid_cnt, square_weight, accepted): The (weighted) count of each placement id
+      and of valid configurations, the sum of the squared sample weights (valid_cnt when unweighted)
+      and the number of samples that are valid configurations (valid_cnt when unweighted).
+      The effective sample size is valid_cnt ** 2 / square_weight.
+    """
+    if mode == "sequential":
+        location_weight, total_weight, ess, accepted = sample_sequential(
+            table, possible_loc, cycles, hit_mask, rng
+        )
+        return location_weight, total_weight, total_weight * total_weight / ess if ess else 0.0, accepted
+
+    if backend == "auto":
+        backend = "python" if np is None else "numpy"
+    if backend == "numpy":
+        location_freq, valid_cnt = sample_configurations_numpy(table, possible_loc, cycles, hit_mask, rng=rng)
+    else:
+        location_freq, valid_cnt = sample_configurations(table, possible_loc, cycles, hit_mask, rng)
+    return location_freq, valid_cnt, valid_cnt, valid_cnt
+
+
+# Process pool shared by the parallel solves, created on first use
+_pool = None
+_pool_workers = 0
+
+
+def process_pool(workers: int) -> "ProcessPoolExecutor":
+    """
+    Returns the shared process pool, (re)creating it if the number of workers changed.
+    Parameters:
+    - workers (int): The number of worker processes.
+    Returns:
+    - ProcessPoolExecutor: The pool.
+    """
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+def sample_parallel(
+    table: "PlacementTable",
+    possible_loc: dict[str, list[int]],
+    hit_mask: int,
+    cycles: int,
+    mode: str,
+    backend: str,
+    rng: "random.Random",
+    workers: int,
+) -> tuple[list[float], float, float, int]:
+    """
+    Splits the sampling cycles across a process pool and merges the counts.
+    Every worker gets its own random generator, seeded from rng, so a seeded solve gives the same
+    result every time.
+    Parameters:
+    - table (PlacementTable): The placement table.
+    - possible_loc (dict): The possible placement ids of each ship type.
+    - hit_mask (int): Bitmask of the hit squares. Configurations must cover all of them.
+    - cycles (int): The total number of configurations to draw.
+    - mode (str): "sample" or "sequential".
+    - backend (str): "python", "numpy" or "auto" for the "sample" mode.
+    - rng (random.Random): The random generator the worker seeds are drawn from.
+    - workers (int): The number of worker processes.
+    Returns:
+    - (location_freq, valid_cnt, square_weight, accepted): See sample.
+    """
+    seeds = [rng.getrandbits(64) for _ in range(workers)]
+    chunks = [cycles // workers + (i < cycles % workers) for i in range(workers)]
+    job = partial(_sample_chunk, table.width, table.height, table.fleet, possible_loc, hit_mask, mode, backend)
+
+    location_freq = [0] * len(table.masks)
+    valid_cnt = 0
+    square_weight = 0
+    accepted = 0
+    for chunk_freq, chunk_cnt, chunk_square, chunk_accepted in process_pool(workers).map(job, chunks, seeds):
+        for pid, count in enumerate(chunk_freq):
+            location_freq[pid] += count
+        valid_cnt += chunk_cnt
+        square_weight += chunk_square
+        accepted += chunk_accepted
+    return location_freq, valid_cnt, square_weight, accepted
+
+
+def _sample_chunk(
+    width: int,
+    height: int,
+    fleet: tuple[tuple[str, int], ...],
+    possible_loc: dict[str, list[int]],
+    hit_mask: int,
+    mode: str,
+    backend: str,
+    cycles: int,
+    seed: int,
+) -> tuple[list[float], float, float, int]:
+    # Runs in a worker process: the placement table is cached once per process
+    table = placement_table(width, height, fleet)
+    return sample(table, possible_loc, hit_mask, cycles, mode, backend, random.Random(seed))
+
+
+def sample_configurations(
+    table: "PlacementTable",
+    possible_loc: dict[str, list[int]],
+    cycles: int,
+    hit_mask: int = 0,
+    rng: "random.Random" = random,
+) -> tuple[list[int], int]:
+    """
+    Samples random fleet configurations and counts how often each placement is used.
+    Parameters:
+    - table (PlacementTable): The placement table.
+    - possible_loc (dict): The possible placement ids of each ship type.
+    - cycles (int): The number of configurations to draw.
+    - hit_mask (int): Bitmask of the hit squares. Configurations must cover all of them.
+    - rng (random.Random): The random generator to use. Default is the global one of the random module.
+    Returns:
+    - (location_freq, valid_cnt): The count of each placement id and the number of valid configurations.
+    """
+    # Number of times each placement id was part of a valid configuration
+    location_freq = [0] * len(table.masks)
     valid_cnt = 0
 
+    masks = table.masks
+    conflicts = table.conflicts
+
     for _ in range(cycles):  # Loop A, y times
         selected_loc = {}
+        # Bitset of the selected placement ids
+        selected_bits = 0
+        occupied = 0
         valid = True
 
         # For each ship
         for ship_type in possible_loc:
             # Select one random possible ship location
-            idx = random.randint(0, len(possible_loc[ship_type]) - 1)
+            idx = rng.randint(0, len(possible_loc[ship_type]) - 1)
             selected_location = possible_loc[ship_type][idx]
 
             # If location is incompatible with any other selected locations, continue loop A
-            for loc in selected_loc.values():
-                if (selected_location, loc) in incompatible_loc or (
-                    loc,
-                    selected_location,
-                ) in incompatible_loc:
-                    valid = False
-                    break
-            if not valid:
+            if conflicts[selected_location] & selected_bits:
+                valid = False
                 break
 
             selected_loc[ship_type] = selected_location
+            selected_bits |= 1 << selected_location
+            occupied |= masks[selected_location]
 
         if not valid:
             continue
 
-        # If this configuration conflicts with the current board state
-        for selected_location in selected_loc.values():
-            if any(
-                board.grid[s[0]][s[1]] == 2 and s not in selected_location
-                for s in selected_location
-            ):
-                valid = False
-                break
-        if not valid:
+        # If this configuration leaves a hit square without a ship, it conflicts with the board
+        if hit_mask & ~occupied:
             continue
+
         # For each selected ship location
-        for ship_type, selected_location in selected_loc.items():
-            location_freq[ship_type][
-                possible_loc[ship_type].index(selected_location)
-            ] += 1
+        for selected_location in selected_loc.values():
+            location_freq[selected_location] += 1
 
         valid_cnt += 1
 
-    # chance of each square being a ship
-    square_freq = [[0 for _ in range(10)] for _ in range(10)]
+    return location_freq, valid_cnt
+
+
+@lru_cache(maxsize=None)
+def square_index(table: "PlacementTable") -> "np.ndarray":
+    """
+    Returns the squares covered by every placement of a placement table, building it only once.
+    Parameters:
+    - table (PlacementTable): The placement table.
+    Returns:
+    - np.ndarray: An int32 matrix with one row per placement id, its squares (row * width + col) first,
+      padded with -1 up to the length of the longest ship.
+    """
+    longest = max((length for _, length in table.fleet), default=0)
+    index = np.full((len(table.masks), longest), -1, dtype=np.int32)
+    for pid, squares in enumerate(table.squares):
+        index[pid, :len(squares)] = [r * table.width + c for r, c in squares]
+    return index
+
+
+def sample_configurations_numpy(
+    table: "PlacementTable",
+    possible_loc: dict[str, list[int]],
+    cycles: int,
+    hit_mask: int = 0,
+    batch: int = NUMPY_BATCH,
+    rng: "random.Random" = random,
+) -> tuple[list[int], int]:
+    """
+    Same as sample_configurations, but draws whole batches of configurations with NumPy.
+    Each batch is one array of placement ids per ship. Their rows of the square index, side by side,
+    list the squares of every configuration: sorted, no square may appear twice. Memory grows with
+    the number of ship squares, not the size of the board.
+    Parameters:
+    - table (PlacementTable): The placement table.
+    - possible_loc (dict): The possible placement ids of each ship type.
+    - cycles (int): The number of configurations to draw.
+    - hit_mask (int): Bitmask of the hit squares. Configurations must cover all of them.
+    - batch (int): The number of configurations to draw at once.
+    - rng (random.Random): Seeds the NumPy generator. Default is the global one of the random module.
+    Returns:
+    - (location_freq, valid_cnt): The count of each placement id and the number of valid configurations.
+    """
+    if np is None:
+        raise ImportError("the numpy backend needs NumPy to be installed")
+    index = square_index(table)
+    lengths = dict(table.fleet)
+    generator = np.random.default_rng(rng.getrandbits(64))
+    locations = [
+        (np.asarray(possible_loc[ship_type], dtype=np.intp), lengths[ship_type]) for ship_type in possible_loc
+    ]
+    cells = table.width * table.height
+    is_hit = np.zeros(cells, dtype=bool)
+    is_hit[[cell for cell in range(cells) if hit_mask >> cell & 1]] = True
+    hit_count = int(is_hit.sum())
+
+    location_freq = np.zeros(len(table.masks), dtype=np.int64)
+    valid_cnt = 0
+    done = 0
+    while done < cycles:
+        size = min(batch, cycles - done)
+        done += size
+        # Pick a random location for every ship in every configuration of the batch
+        picks = [loc[generator.integers(0, len(loc), size)] for loc, _ in locations]
+        squares = np.concatenate(
+            [index[pick, :length] for pick, (_, length) in zip(picks, locations)], axis=1
+        )
+        # No square may hold two ships, and (then) every hit square needs its own
+        ordered = np.sort(squares, axis=1)
+        valid = (ordered[:, 1:] != ordered[:, :-1]).all(axis=1)
+        if hit_count:
+            valid &= is_hit[squares].sum(axis=1) == hit_count
+        for pick in picks:
+            location_freq += np.bincount(pick[valid], minlength=len(location_freq))
+        valid_cnt += int(valid.sum())
+
+    return location_freq.tolist(), valid_cnt
+
+
+def sample_sequential(
+    table: "PlacementTable",
+    possible_loc: dict[str, list[int]],
+    cycles: int,
+    hit_mask: int = 0,
+    rng: "random.Random" = random,
+) -> tuple[list[float], float, float, int]:
+    """
+    Samples fleet configurations one ship at a time, only from the locations that do not overlap
+    the ships already placed, so no sample is thrown away (see draw_sequential).
+    Parameters:
+    - table (PlacementTable): The placement table.
+    - possible_loc (dict): The possible placement ids of each ship type.
+    - cycles (int): The number of configurations to draw.
+    - hit_mask (int): Bitmask of the hit squares. Configurations must cover all of them.
+    - rng (random.Random): The random generator to use. Default is the global one of the random module.
+    Returns:
+    - (location_weight, total_weight, ess, accepted): The weight of each placement id, the sum of
+      the sample weights, the effective sample size (how many uniform samples they are worth) and
+      the number of samples that did not hit a dead end.
+    """
+    location_weight = [0.0] * len(table.masks)
+    total_weight = 0.0
+    total_square = 0.0
+    accepted = 0
+
+    for weight, _, selected in draw_sequential(table, possible_loc, cycles, hit_mask, rng):
+        for pid in selected:
+            location_weight[pid] += weight
+        total_weight += weight
+        total_square += weight * weight
+        accepted += 1
+
+    ess = total_weight * total_weight / total_square if total_square else 0.0
+    return location_weight, total_weight, ess, accepted
+
+
+def draw_sequential(
+    table: "PlacementTable",
+    possible_loc: dict[str, list[int]],
+    cycles: int,
+    hit_mask: int = 0,
+    rng: "random.Random" = random,
+) -> "Iterator[tuple[float, int, tuple[int, ...]]]":
+    """
+    Draws fleet configurations one ship at a time, only from the locations that do not overlap
+    the ships already placed.
+    Hits are explained first: while a hit square is uncovered, the next ship is one of the
+    locations covering the first uncovered hit (found with the square index). The ships left
+    over are then placed anywhere they fit.
+    Configurations with fewer choices along the way would be drawn too often, so each sample is
+    weighted by the number of choices it had (importance weights). Weighted counts estimate
+    the same frequencies as uniform sampling of the configurations that cover all hits.
+    Parameters:
+    - table (PlacementTable): The placement table.
+    - possible_loc (dict): The possible placement ids of each ship type.
+    - cycles (int): The number of configurations to draw.
+    - hit_mask (int): Bitmask of the hit squares. Configurations must cover all of them.
+    - rng (random.Random): The random generator to use. Default is the global one of the random module.
+    Yields:
+    - (weight, occupied, selected): The sample weight, the bitmask of the squares covered by the
+      fleet and its placement ids, in the order of possible_loc. Draws that hit a dead end
+      (weight 0) are skipped.
+    """
+    masks = table.masks
+    squares = table.squares
+    cell_bits = table.cell_bits
+    width = table.width
+    lengths = dict(table.fleet)
+    # Ships with the fewest locations first keeps the weights even
+    ships = sorted(possible_loc, key=lambda ship_type: len(possible_loc[ship_type]))
+    # Bitset of the possible placement ids of each ship, to look up the square index
+    # and to draw the ships left over. Ships of the same length mostly have the same
+    # locations, so each distinct list is only turned into a bitset once
+    bitsets = {}
+    live_bits = {}
+    for ship_type in ships:
+        locations = tuple(possible_loc[ship_type])
+        if locations not in bitsets:
+            bitsets[locations] = table.bitset(locations)
+        live_bits[ship_type] = bitsets[locations]
+
+    for _ in range(cycles):
+        occupied = 0
+        # Bitset of the placement ids overlapping the ships placed so far
+        blocked = 0
+        weight = 1.0
+        selected = {}
+        unplaced = list(ships)
+        unplaced_length = sum(lengths[ship_type] for ship_type in ships)
+
+        # While a hit is uncovered, place a ship over the first one
+        uncovered = hit_mask
+        while uncovered and weight:
+            if uncovered.bit_count() > unplaced_length:  # the ships left are too short
+                weight = 0.0
+                break
+            cell = (uncovered & -uncovered).bit_length() - 1
+            choices = [
+                (ship_type, pid)
+                for ship_type in unplaced
+                for pid in table.cell_ids[cell]
+                if live_bits[ship_type] >> pid & 1 and not occupied & masks[pid]
+            ]
+            if not choices:  # dead end, the sample gets no weight
+                weight = 0.0
+                break
+            ship_type, pid = choices[rng.randrange(len(choices))]
+            weight *= len(choices)
+            occupied |= masks[pid]
+            for s in squares[pid]:
+                blocked |= cell_bits[s[0] * width + s[1]]
+            selected[ship_type] = pid
+            unplaced.remove(ship_type)
+            unplaced_length -= lengths[ship_type]
+            uncovered = hit_mask & ~occupied
+
+        # For each other ship, pick one of the locations that fit next to the ships already placed
+        # (the free ids are counted and selected in the bitsets, without listing them)
+        for ship_type in unplaced:
+            if not weight:
+                break
+            free = live_bits[ship_type] & ~blocked
+            count = free.bit_count()
+            if not count:  # dead end, the sample gets no weight
+                weight = 0.0
+                break
+            pid = table.select(free, rng.randrange(count))
+            weight *= count
+            occupied |= masks[pid]
+            for s in squares[pid]:
+                blocked |= cell_bits[s[0] * width + s[1]]
+            selected[ship_type] = pid
+
+        if weight:
+            yield weight, occupied, tuple(selected[ship_type] for ship_type in possible_loc)
+
+
+def is_settled(square_freq: list[list[float]], ess: float) -> bool:
+    """
+    Checks if the best square of a sampled frequency map is statistically settled.
+    Parameters:
+    - square_freq (list): The frequency map.
+    - ess (float): The effective sample size it was estimated from.
+    Returns:
+    - bool: True if the best square beats the runner-up by more than CONFIDENCE_Z standard
+      errors, or if both are known to within STABLE_TOLERANCE.
+    """
+    if ess < BUDGET_MIN_SAMPLES:
+        return False
+    first = second = 0.0
+    for row in square_freq:
+        for p in row:
+            if p > first:
+                first, second = p, first
+            elif p > second:
+                second = p
+    # Standard error of the difference of two frequencies
+    error = math.sqrt((first * (1 - first) + second * (1 - second)) / ess)
+    return first - second > CONFIDENCE_Z * error or CONFIDENCE_Z * error < STABLE_TOLERANCE
+
+
+def count_conflicts(table: "PlacementTable", possible_loc: dict[str, list[int]]) -> int:
+    """
+    Counts the overlapping pairs of possible locations of different ships, with the conflict index.
+    Ships of the same length mostly have the same locations, so the pairs are counted once for
+    each pair of distinct location lists and multiplied by the number of ships having them.
+    Parameters:
+    - table (PlacementTable): The placement table.
+    - possible_loc (dict): The possible placement ids of each ship type.
+    Returns:
+    - int: The number of (location, other ship's location) pairs that overlap, counted both ways.
+    """
+    conflicts = table.conflicts
+    # The number of ships having each distinct location list
+    ships: dict[tuple[int, ...], int] = {}
+    for locations in possible_loc.values():
+        key = tuple(locations)
+        ships[key] = ships.get(key, 0) + 1
+    lists = [(locations, table.bitset(locations), count) for locations, count in ships.items()]
+    total = 0
+    for locations, _, count in lists:
+        for other, bits, other_count in lists:
+            # A ship is not paired with itself
+            pairs = count * (other_count - 1 if other is locations else other_count)
+            if pairs:
+                total += pairs * sum((conflicts[pid] & bits).bit_count() for pid in locations)
+    return total
+
+
+def estimate_configurations(possible_loc: dict[str, list[int]]) -> int:
+    """
+    Estimates the number of fleet configurations, ignoring overlaps.
+    Parameters:
+    - possible_loc (dict): The possible placement ids of each ship type.
+    Returns:
+    - int: The product of the number of possible locations of every ship (an upper bound).
+    """
+    estimate = 1
+    for locations in possible_loc.values():
+        estimate *= len(locations)
+    return estimate
+
+
+def count_configurations(
+    table: "PlacementTable",
+    possible_loc: dict[str, list[int]],
+    hit_mask: int,
+    max_states: int = EXACT_MAX_STATES,
+    deadline: float | None = None,
+) -> tuple[list[int], int] | None:
+    """
+    Counts every fleet configuration that covers all hits without overlapping.
+    Ships are placed one after the other. Partial fleets with the same ships placed and the
+    same occupied squares are merged, so each (remaining ships, occupied mask) state is only
+    expanded once.
+    Parameters:
+    - table (PlacementTable): The placement table.
+    - possible_loc (dict): The possible placement ids of each ship type.
+    - hit_mask (int): Bitmask of the hit squares, which must all be covered.
+    - max_states (int): Give up if a step has more partial fleets than this.
+    - deadline (float): Give up if time.perf_counter() passes this.
+    Returns:
+    - (location_freq, valid_cnt): The number of configurations using each placement id and the
+      total number of configurations, or None if there are too many to count (in time).
+    """
+    masks = table.masks
+    # Ships with the fewest locations first keeps the number of partial fleets small
+    ships = sorted(possible_loc, key=lambda ship_type: len(possible_loc[ship_type]))
+    # Squares the ships after each step can still cover
+    lengths = dict(table.fleet)
+    remaining = [sum(lengths[t] for t in ships[i + 1:]) for i in range(len(ships))]
+
+    # Forward: the number of ways to reach each occupied mask after placing the first i ships
+    layers = [{0: 1}]
+    for i, ship_type in enumerate(ships):
+        next_layer = {}
+        for occupied, ways in layers[-1].items():
+            if len(next_layer) > max_states:
+                return None
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            for pid in possible_loc[ship_type]:
+                if occupied & masks[pid]:
+                    continue
+                new_occupied = occupied | masks[pid]
+                # Prune: the ships left must be able to cover the hits that are still uncovered
+                if (hit_mask & ~new_occupied).bit_count() > remaining[i]:
+                    continue
+                next_layer[new_occupied] = next_layer.get(new_occupied, 0) + ways
+        if len(next_layer) > max_states:
+            return None
+        layers.append(next_layer)
+
+    # Backward: the number of ways to complete the fleet from each state,
+    # which also gives the number of configurations using each placement
+    location_freq = [0] * len(masks)
+    completions = dict.fromkeys(layers[-1], 1)
+    for i in reversed(range(len(ships))):
+        previous = {}
+        for occupied, ways in layers[i].items():
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            total = 0
+            for pid in possible_loc[ships[i]]:
+                if occupied & masks[pid]:
+                    continue
+                count = completions.get(occupied | masks[pid])
+                if count:
+                    total += count
+                    location_freq[pid] += ways * count
+            if total:
+                previous[occupied] = total
+        completions = previous
+
+    return location_freq, completions.get(0, 0)
+
+
+def board_masks(board: "Board") -> tuple[int, int]:
+    """
+    Reads the shot state of a board as bitmasks.
+    Parameters:
+    - board (Board): The battleship board object.
+    Returns:
+    - (miss_mask, hit_mask): Bitmasks of the missed and hit squares, bit row * width + col.
+    """
+    return board.shotMasks()
+
+
+def square_frequencies(
+    table: "PlacementTable", location_freq: list[float], valid_cnt: float, shot_mask: int
+) -> list[list[float]]:
+    """
+    Turns placement counts into the chance of each square being a ship.
+    Parameters:
+    - table (PlacementTable): The placement table the counts refer to.
+    - location_freq (list): How often each placement id was sampled.
+    - valid_cnt (float): The number of valid configurations sampled.
+    - shot_mask (int): Bitmask of the squares already guessed, which get a frequency of 0.
+    Returns:
+    - square_freq (list): A 2D list representing the frequency of ship locations on each square of the board.
+    """
+    width, height = table.width, table.height
+    square_freq = [[0 for _ in range(width)] for _ in range(height)]
 
-    # For each possible ship location
-    for ship_type in possible_loc:
-        for index, pos in enumerate(possible_loc[ship_type]):
-            # For each square covered by this ship location
-            for s in pos:
-                if board.grid[s[0]][s[1]] == 0:  # don't guess hit locations
-                    square_freq[s[0]][s[1]] += location_freq[ship_type][index]
+    # For each square, add up the placements covering it
+    for x in range(height):
+        for y in range(width):
+            if not shot_mask >> (x * width + y) & 1:  # don't guess hit locations
+                square_freq[x][y] = sum(location_freq[pid] for pid in table.cell_ids[x * width + y])
 
     # Divide each element in square_freq by valid_cnt
     # not really necessary, but it makes the values make more sense
-    for x in range(10):
-        for y in range(10):
-            if valid_cnt == 0:
-                return square_freq
+    if valid_cnt == 0:
+        return square_freq
+    for x in range(height):
+        for y in range(width):
             square_freq[x][y] /= valid_cnt
 
     return square_freq
@@ -0,0 +1,269 @@
+# Description: This file contains the transposition cache of the solver.
+# Board states are identified by a Zobrist hash: every (square, state) pair has a random key and the
+# hash of a board is the XOR of the keys of its squares, so a shot updates it with a single XOR.
+# The board and the fleet look the same after any of the 8 rotations and reflections of the square
+# (4 for a rectangle), so the cache stores every state in a canonical orientation: the one with the smallest hash.
+from collections import OrderedDict
+from functools import lru_cache
+import json
+import random
+import sqlite3
+import threading
+import zlib
+
+# Number of board states kept in memory by default
+CACHE_CAPACITY = 4096
+
+
+@lru_cache(maxsize=None)
+def symmetries(width: int, height: int) -> tuple[tuple[int, ...], ...]:
+    """
+    Returns the rotations and reflections of a board, the identity first: 8 for a square board,
+    4 for a rectangle (the ones that turn it by 90 degrees change its shape).
+
+    Parameters:
+    - width, height (int): The number of columns and rows of the board.
+
+    Returns:
+    - tuple: For each symmetry, the image of each square (squares are numbered row * width + col).
+    """
+    maps = []
+    for transpose in (False, True) if width == height else (False,):
+        for flip_rows in (False, True):
+            for flip_cols in (False, True):
+                image = []
+                for cell in range(width * height):
+                    r, c = divmod(cell, width)
+                    if transpose:
+                        r, c = c, r
+                    if flip_rows:
+                        r = height - 1 - r
+                    if flip_cols:
+                        c = width - 1 - c
+                    image.append(r * width + c)
+                maps.append(tuple(image))
+    return tuple(maps)
+
+
+def to_canonical(square_freq: list[list[float]], image: tuple[int, ...]) -> list[list[float]]:
+    """
+    Moves a frequency map to the canonical orientation (each square to its image).
+    """
+    width = len(square_freq[0])
+    moved = [[0.0] * width for _ in square_freq]
+    for cell, target in enumerate(image):
+        r, c = divmod(target, width)
+        moved[r][c] = square_freq[cell // width][cell % width]
+    return moved
+
+
+def from_canonical(square_freq: list[list[float]], image: tuple[int, ...]) -> list[list[float]]:
+    """
+    Moves a frequency map back from the canonical orientation (undoes to_canonical).
+    """
+    width = len(square_freq[0])
+    moved = [[0.0] * width for _ in square_freq]
+    for cell, target in enumerate(image):
+        moved[cell // width][cell % width] = square_freq[target // width][target % width]
+    return moved
+
+
+def symmetrize(square_freq: list[list[float]], images: list[tuple[int, ...]]) -> list[list[float]]:
+    """
+    Averages a frequency map over symmetries the board state has (its stabilizer).
+    The exact map is the same on the squares a symmetry swaps, so averaging them keeps it
+    unbiased and cuts the sampling noise, by up to 8 times the samples on the empty square board.
+
+    Parameters:
+    - square_freq (list): The frequency map.
+    - images (list): The symmetries of the state, as returned by symmetries. They must form a group.
+
+    Returns:
+    - list: The averaged frequency map.
+    """
+    width = len(square_freq[0])
+    averaged = [[0.0] * width for _ in square_freq]
+    for cell in range(width * len(square_freq)):
+        total = 0.0
+        for image in images:
+            target = image[cell]
+            total += square_freq[target // width][target % width]
+        averaged[cell // width][cell % width] = total / len(images)
+    return averaged
+
+
+class ZobristKeys:
+    # The random keys of one board size and fleet.
+    # They only depend on the size and the fleet, so hashes are the same in every process and run.
+
+    def __init__(self: "ZobristKeys", width: int, height: int, fleet: tuple[tuple[str, int], ...]) -> None:
+        """
+        Draws the keys of a board size and fleet.
+
+        Parameters:
+        - width, height (int): The number of columns and rows of the board.
+        - fleet (tuple): (ship type, ship length) pairs, like Board.types.items().
+
+        Attributes:
+        - miss (list): The key of each square when it was missed.
+        - hit (list): The key of each square when it was hit.
+        - sunk_cells (list): The key of each square when it is known to be part of a sunk ship.
+        - sunk (dict): The key of each ship type once it is sunk.
+        - maps (tuple): The symmetries of the board, see symmetries.
+        - miss_images, hit_images, sunk_cell_images (list): For each square, the keys of its
+          images under every symmetry, so a shot updates the hashes of all orientations at once.
+        """
+        # Seeded by the size and fleet (crc32 is stable across runs, unlike hash of a str)
+        rng = random.Random(zlib.crc32(repr((width, height, fleet)).encode()))
+        cells = width * height
+        # 63 bits, so a hash fits in a signed 64-bit SQLite integer
+        self.miss: list[int] = [rng.getrandbits(63) for _ in range(cells)]
+        self.hit: list[int] = [rng.getrandbits(63) for _ in range(cells)]
+        self.sunk_cells: list[int] = [rng.getrandbits(63) for _ in range(cells)]
+        self.sunk: dict[str, int] = {ship_type: rng.getrandbits(63) for ship_type, _ in fleet}
+
+        self.maps = symmetries(width, height)
+        self.miss_images = [tuple(self.miss[m[cell]] for m in self.maps) for cell in range(cells)]
+        self.hit_images = [tuple(self.hit[m[cell]] for m in self.maps) for cell in range(cells)]
+        self.sunk_cell_images = [tuple(self.sunk_cells[m[cell]] for m in self.maps) for cell in range(cells)]
+
+    def keys(self: "ZobristKeys", miss_mask: int, hit_mask: int) -> list[int]:
+        """
+        Hashes the shots of a board from scratch, in every orientation (the sunk ships are
+        XORed in by the caller).
+
+        Parameters:
+        - miss_mask (int): Bitmask of the missed squares.
+        - hit_mask (int): Bitmask of the hit squares.
+
+        Returns:
+        - list: The hash of the board turned by each symmetry of maps. The smallest one is the
+          canonical hash, symmetries with the same hash as the identity map the board onto itself.
+        """
+        keys = [0] * len(self.maps)
+        for mask, images in ((miss_mask, self.miss_images), (hit_mask, self.hit_images)):
+            while mask:
+                low = mask & -mask
+                keys = [key ^ image for key, image in zip(keys, images[low.bit_length() - 1])]
+                mask ^= low
+        return keys
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(width: int, height: int, fleet: tuple[tuple[str, int], ...]) -> ZobristKeys:
+    """
+    Returns the Zobrist keys of a board size and fleet, drawing them only once.
+    """
+    return ZobristKeys(width, height, fleet)
+
+
+class TranspositionCache:
+    # Frequency maps of board states already solved, keyed by Zobrist hash.
+    # The most recently used states are kept in memory; with a path, every state is also stored
+    # in an SQLite file, so other processes and later runs can use it too.
+
+    def __init__(self: "TranspositionCache", capacity: int = CACHE_CAPACITY, path: str | None = None) -> None:
+        """
+        Creates an empty cache, or opens the one stored at a path.
+
+        Parameters:
+        - capacity (int): The number of states kept in memory, the least recently used go first.
+        - path (str): If given, the SQLite file the states are stored in.
+
+        Attributes:
+        - hits, misses (int): The number of lookups that found a state, and that did not.
+        """
+        self.capacity = capacity
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[list[list[float]], int, bool]] = OrderedDict()
+        # The solver may run on a background thread (see __main__), SQLite connections are not shared by default
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS positions"
+                " (key INTEGER PRIMARY KEY, samples INTEGER, exact INTEGER, heatmap TEXT)"
+            )
+            self._db.commit()
+
+    def __len__(self: "TranspositionCache") -> int:
+        return len(self._entries)
+
+    def get(self: "TranspositionCache", key: int) -> tuple[list[list[float]], int, bool] | None:
+        """
+        Looks a board state up.
+
+        Parameters:
+        - key (int): The Zobrist hash of the state.
+
+        Returns:
+        - (square_freq, samples, exact), or None if the state was never solved. samples is the
+          number of valid configurations the frequency map is based on, exact is True for an
+          exact count.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute(
+                    "SELECT heatmap, samples, exact FROM positions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = json.loads(row[0]), row[1], bool(row[2])
+                    self._remember(key, entry)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(
+        self: "TranspositionCache", key: int, square_freq: list[list[float]], samples: int, exact: bool
+    ) -> None:
+        """
+        Stores the frequency map of a board state, replacing the one stored before.
+
+        Parameters:
+        - key (int): The Zobrist hash of the state.
+        - square_freq (list): The frequency map.
+        - samples (int): The number of valid configurations it is based on (not the draws:
+          rejected or duplicate samples add nothing to a map).
+        - exact (bool): True if it is an exact count.
+        """
+        entry = square_freq, samples, exact
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?)",
+                    (key, samples, int(exact), json.dumps(square_freq)),
+                )
+                self._db.commit()
+
+    def _remember(self: "TranspositionCache", key: int, entry: tuple[list[list[float]], int, bool]) -> None:
+        # Adds an entry to memory, evicting the least recently used one if full
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def close(self: "TranspositionCache") -> None:
+        """
+        Closes the SQLite file, if any. The states in memory stay available.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+@lru_cache(maxsize=None)
+def shared_cache(path: str | None = None) -> TranspositionCache:
+    """
+    Returns the cache of this process for a path (or the in-memory one), opening it only once.
+    """
+    return TranspositionCache(path=path)